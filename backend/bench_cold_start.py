@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from latency_report import percentile
+
+# --- Configuration ---
+FUNCTIONS_DIR = Path(__file__).resolve().parent.parent / "functions"
+DEFAULT_RUNS = 10
+
+# Runs inside each fresh interpreter: import main exactly like the Functions runtime does,
+# optionally create the lazy clients, and report the wall time seen from inside.
+CHILD_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import main
+if "--clients" in sys.argv:
+    main.get_openai_client()
+    main.get_db()
+print(json.dumps({"event": "child_done", "import_ms": (time.perf_counter() - started) * 1000}), flush=True)
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure cold-start cost of functions/main.py in fresh interpreters.")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="number of fresh interpreters to spawn")
+    parser.add_argument("--clients", action="store_true",
+                        help="also create the Firestore and OpenAI clients (needs service-account-key.json)")
+    parser.add_argument("--importtime", action="store_true",
+                        help="print the slowest modules from one extra `python -X importtime` run")
+    return parser.parse_args()
+
+
+def run_once(clients):
+    env = dict(os.environ, MEME_STARTUP_PROFILE="1", PYTHONDONTWRITEBYTECODE="1")
+    command = [sys.executable, "-c", CHILD_SCRIPT] + (["--clients"] if clients else [])
+    started = time.perf_counter()
+    result = subprocess.run(command, cwd=FUNCTIONS_DIR, env=env, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"Child interpreter failed:\n{result.stderr}")
+
+    spans = {}
+    for line in result.stdout.splitlines():
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if event.get("event") == "startup_profile":
+            spans.update(event["spans"])
+    spans["process_wall"] = wall_ms
+    return spans
+
+
+def print_importtime():
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=FUNCTIONS_DIR, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    print("\n🐢 Slowest imports (cumulative):")
+    for cumulative_us, name in sorted(rows, reverse=True)[:15]:
+        print(f"   {cumulative_us / 1000:8.1f} ms  {name}")
+
+
+def main():
+    args = parse_args()
+    print(f"🚀 Spawning {args.runs} fresh interpreters for functions/main.py...")
+    runs = [run_once(args.clients) for _ in range(args.runs)]
+
+    names = sorted({name for run in runs for name in run}, key=lambda name: name != "process_wall")
+    print(f"\n{'phase':<28}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name in names:
+        values = [run[name] for run in runs if name in run]
+        print(f"{name:<28}{statistics.median(values):>10.1f}{percentile(values, 0.95):>10.1f}{max(values):>10.1f}")
+
+    if args.importtime:
+        print_importtime()
+
+
+if __name__ == "__main__":
+    main()
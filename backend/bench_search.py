@@ -0,0 +1,336 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from latency_report import percentile
+
+# --- Configuration ---
+FUNCTIONS_DIR = Path(__file__).resolve().parent.parent / "functions"
+# The search code lives with the Cloud Function; the benchmark runs it in-process.
+sys.path.insert(0, str(FUNCTIONS_DIR))
+from embedding_provider import HashEmbeddingProvider
+
+DEFAULT_SIZES = [100, 1_000, 10_000, 100_000]
+DEFAULT_FOLDERS = ["mygo", "popular"]
+EMBEDDING_DIM = 1536  # text-embedding-ada-002
+# Rows generated per RNG call when the fake Firestore streams a folder.
+STREAM_CHUNK_ROWS = 4096
+# Words mixed into the synthetic descriptions so hybrid (BM25) search has something to match.
+SYNTHETIC_WORDS = ["上班", "下班", "開會", "生氣", "好累", "謝謝", "抱歉", "晚安", "吃飯", "考試",
+                   "加油", "無言", "好耶", "崩潰", "請假", "週末", "報告", "遲到", "睡覺", "約會"]
+
+
+# --- Local stand-ins for Firestore and OpenAI ---
+# The fake corpus is generated while it is streamed, so the benchmark process only holds
+# what the search function itself keeps in memory.
+
+def synthetic_description(folder_id, row):
+    words = [SYNTHETIC_WORDS[(row * 7 + k * 3) % len(SYNTHETIC_WORDS)] for k in range(3)]
+    return f"{folder_id} 第{row}張 {words[0]}\n{words[1]}的時候\n回覆{words[2]}"
+
+
+class FakeSnapshot:
+    def __init__(self, data, doc_id=None):
+        self._data = data
+        self.exists = data is not None
+        self.id = doc_id
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeItemsQuery:
+    def __init__(self, corpus, folder_id=None):
+        self._corpus = corpus
+        self._folder_id = folder_id
+
+    def where(self, field, op, value):
+        return FakeItemsQuery(self._corpus, value)
+
+    def select(self, fields):
+        return self
+
+    def stream(self):
+        return self._corpus.stream_folder(self._folder_id)
+
+
+class FakeDocument:
+    def __init__(self, data):
+        self._data = data
+
+    def get(self):
+        return FakeSnapshot(self._data)
+
+
+class FakeCollection:
+    def __init__(self, documents):
+        self._documents = documents
+
+    def document(self, name):
+        return FakeDocument(self._documents.get(name))
+
+
+class FakeFirestore:
+    """Answers the two reads the search path makes: the items collection group filtered by
+    folder_id, and meta/corpus. `size` memes are split evenly over `folders`."""
+
+    def __init__(self, size, folders, dim=EMBEDDING_DIM, seed=0):
+        self.dim = dim
+        self.seed = seed
+        self.rows_per_folder = {folder_id: size // len(folders) + (i < size % len(folders))
+                                for i, folder_id in enumerate(folders)}
+        self._collections = {"meta": {"corpus": {"version": 1}}}
+
+    def collection_group(self, name):
+        return FakeItemsQuery(self)
+
+    def collection(self, name):
+        return FakeCollection(self._collections.get(name, {}))
+
+    def stream_folder(self, folder_id):
+        rows = self.rows_per_folder.get(folder_id, 0)
+        folder_index = sorted(self.rows_per_folder).index(folder_id) if rows else 0
+        for start in range(0, rows, STREAM_CHUNK_ROWS):
+            stop = min(rows, start + STREAM_CHUNK_ROWS)
+            rng = np.random.default_rng((self.seed, folder_index, start))
+            vectors = rng.standard_normal((stop - start, self.dim), dtype=np.float32)
+            for offset, row in enumerate(range(start, stop)):
+                yield FakeSnapshot({
+                    "id": str(row),
+                    "description": synthetic_description(folder_id, row),
+                    "embedding": vectors[offset],
+                    "folder_id": folder_id,
+                }, str(row))
+
+
+class SlowHashEmbeddingProvider(HashEmbeddingProvider):
+    """The offline hash backend plus `latency_ms` per request to simulate the OpenAI round trip."""
+
+    def __init__(self, dim=EMBEDDING_DIM, latency_ms=0.0, **kwargs):
+        super().__init__(dim=dim, **kwargs)
+        self.latency_ms = latency_ms
+
+    def _embed_batch(self, texts):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return super()._embed_batch(texts)
+
+
+# --- Child: one configuration in a fresh interpreter ---
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def build_artifacts(args):
+    """Builds IVF and/or projection artifacts from the fake corpus into MEME_INDEX_DIR, the
+    way build_index.py does from Firestore. Runs in its own interpreter so the benchmark
+    child's peak RSS does not include it."""
+    from ann_index import IVFIndex, ann_artifact_path
+    from meme_index import load_folder_shard
+    from projection import PROJECTION_PATH, Projection
+
+    db = FakeFirestore(args.size, args.folders, args.dim)
+    shards = [load_folder_shard(db, folder_id, precision="float32") for folder_id in args.folders]
+    shards = [shard for shard in shards if len(shard) >= 2]
+    if args.ann:
+        for shard in shards:
+            IVFIndex.build(shard.matrix, shard.ids, nlist=args.nlist).save(ann_artifact_path(shard.folder_id))
+    if args.projection_dim and shards:
+        matrix = np.concatenate([shard.matrix for shard in shards])
+        Projection.fit_pca(matrix, args.projection_dim).save(PROJECTION_PATH)
+
+
+def run_child(args):
+    # Keep the run hermetic: only the artifacts built for this configuration (if any) in
+    # a fresh index dir, no persistent embedding cache and no per-request log lines.
+    os.environ.setdefault("MEME_INDEX_DIR", tempfile.mkdtemp(prefix="bench_index_"))
+    os.environ["EMBEDDING_CACHE_BACKEND"] = "none"
+    os.environ["REQUEST_TIMING_LOG"] = "0"
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+    import flask
+    from werkzeug.test import EnvironBuilder
+
+    import main
+
+    concurrency = args.concurrency[0]
+    main._db = FakeFirestore(args.size, args.folders, args.dim)
+    # Same number of slots as the serving profile main.py built, so embedding waits are realistic.
+    embeddings = SlowHashEmbeddingProvider(args.dim, args.embed_latency_ms,
+                                           max_concurrency=main.embedding_provider.max_concurrency)
+    main.embedding_provider = embeddings
+
+    def search(query):
+        body = {"query": query, "top_k": args.top_k, "enabled_folders": args.folders, "mode": args.mode}
+        environ = EnvironBuilder(method="POST", json=body, headers={"Accept-Encoding": "gzip"}).get_environ()
+        started = time.perf_counter()
+        response = main.find_similar_memes_v2(flask.Request(environ))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f"Search failed with {response.status_code}: {response.get_data(as_text=True)}")
+        return elapsed_ms
+
+    queries = [f"{SYNTHETIC_WORDS[i % len(SYNTHETIC_WORDS)]} 查詢 {i}" for i in range(args.distinct_queries)]
+
+    # The first request pays for streaming the folders and building the matrices.
+    cold_ms = search("cold start query")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(search, (queries[i % len(queries)] for i in range(args.requests))))
+    wall_s = time.perf_counter() - started
+
+    latencies.sort()
+    peak_mb = peak_rss_mb()
+    print(json.dumps({
+        "event": "bench_result",
+        "size": args.size,
+        "mode": args.mode,
+        "top_k": args.top_k,
+        "concurrency": concurrency,
+        "env": dict(item.split("=", 1) for item in args.env),
+        "ann": args.ann,
+        "projection_dim": args.projection_dim,
+        "requests": args.requests,
+        "cold_ms": round(cold_ms, 2),
+        "qps": round(args.requests / wall_s, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "embedding_calls": embeddings.requests,
+        "peak_rss_mb": None if peak_mb is None else round(peak_mb, 1),
+    }), flush=True)
+
+
+# --- Parent: spawn one child per configuration and tabulate ---
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Offline QPS/latency/memory benchmark of find_similar_memes_v2 against a fake Firestore "
+                    "and the offline hash embedding provider. Each configuration runs in a fresh interpreter.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="corpus sizes to test (1000000 at 1536 dims needs ~10 GB of RAM)")
+    parser.add_argument("--folders", nargs="+", default=DEFAULT_FOLDERS, help="folders the corpus is split over")
+    parser.add_argument("--modes", nargs="+", default=["vector"], choices=["vector", "hybrid"])
+    parser.add_argument("--top-k", type=int, default=25)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1], help="client threads per run")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per configuration")
+    parser.add_argument("--distinct-queries", type=int, default=1000,
+                        help="size of the query pool; fewer than --requests means repeated queries")
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="simulated OpenAI latency per call")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="environment for the function, e.g. MEME_INDEX_PRECISION=int8 (repeatable)")
+    parser.add_argument("--ann", action="store_true",
+                        help="build IVF artifacts for each folder before the run (used from ANN_MIN_ROWS rows, "
+                             "lower it with --env ANN_MIN_ROWS=...)")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF clusters per folder (default: sqrt(rows))")
+    parser.add_argument("--projection-dim", type=int, default=0,
+                        help="learn a PCA coarse projection of this many dims before the run (used from "
+                             "MEME_INDEX_PROJECTION_MIN_ROWS rows per folder)")
+    parser.add_argument("--output", help="write the results as JSON, to use later as --baseline")
+    parser.add_argument("--baseline", help="JSON from an earlier --output run to compare against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--build-artifacts", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def run_configuration(args, size, mode, concurrency):
+    command = [sys.executable, __file__, "--size", str(size), "--mode", mode,
+               "--top-k", str(args.top_k), "--concurrency", str(concurrency), "--requests", str(args.requests),
+               "--distinct-queries", str(args.distinct_queries), "--dim", str(args.dim),
+               "--embed-latency-ms", str(args.embed_latency_ms), "--folders", *args.folders,
+               "--projection-dim", str(args.projection_dim)]
+    if args.ann:
+        command.append("--ann")
+    if args.nlist:
+        command += ["--nlist", str(args.nlist)]
+    for item in args.env:
+        command += ["--env", item]
+    with tempfile.TemporaryDirectory(prefix="bench_index_") as index_dir:
+        env = dict(os.environ, **dict(item.split("=", 1) for item in args.env), MEME_INDEX_DIR=index_dir)
+        if args.ann or args.projection_dim:
+            result = subprocess.run(command + ["--build-artifacts"], cwd=FUNCTIONS_DIR, env=env,
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"Building benchmark artifacts failed:\n{result.stderr}")
+        result = subprocess.run(command + ["--child"], cwd=FUNCTIONS_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmark child failed:\n{result.stderr}")
+    for line in result.stdout.splitlines():
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if event.get("event") == "bench_result":
+            return event
+    raise RuntimeError(f"Benchmark child printed no result:\n{result.stdout}")
+
+
+def configuration_key(result):
+    return (result["size"], result["mode"], result["top_k"], result["concurrency"],
+            tuple(sorted(result.get("env", {}).items())), result.get("ann", False), result.get("projection_dim", 0))
+
+
+def main():
+    args = parse_args()
+    if args.build_artifacts:
+        build_artifacts(args)
+        return
+    if args.child:
+        run_child(args)
+        return
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = {configuration_key(result): result for result in json.load(f)}
+
+    print(f"🚀 Benchmarking find_similar_memes_v2 ({args.requests} requests per configuration)...")
+    header = f"{'size':>9} {'mode':<7}{'conc':>5}{'cold ms':>10}{'QPS':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'peak MB':>9}"
+    if baseline:
+        header += f"{'Δ QPS':>9}{'Δ p95':>9}"
+    print(header)
+
+    results = []
+    for size in args.sizes:
+        for mode in args.modes:
+            for concurrency in args.concurrency:
+                result = run_configuration(args, size, mode, concurrency)
+                results.append(result)
+                peak = "n/a" if result["peak_rss_mb"] is None else f"{result['peak_rss_mb']:.0f}"
+                line = (f"{size:>9} {mode:<7}{concurrency:>5}{result['cold_ms']:>10.1f}{result['qps']:>9.1f}"
+                        f"{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}{peak:>9}")
+                previous = baseline.get(configuration_key(result))
+                if previous:
+                    line += (f"{(result['qps'] / previous['qps'] - 1) * 100:>+8.0f}%"
+                             f"{(result['p95_ms'] / previous['p95_ms'] - 1) * 100:>+8.0f}%")
+                print(line, flush=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Results written to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
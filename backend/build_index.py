@@ -0,0 +1,156 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+# The index code lives with the Cloud Function so both sides share one implementation.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "functions"))
+from ann_index import ANN_NPROBE, IVFIndex, ann_artifact_path, recall_at_k
+from embedding_provider import create_embedding_provider
+from index_snapshot import write_snapshot
+from meme_index import compare_precision, compare_projection, load_folder_shard, normalize_rows, read_corpus_version
+from projection import PROJECTION_PATH, Projection
+
+# --- Configuration ---
+FIREBASE_CREDS_PATH = "./ai-meme-suggestion-firebase-adminsdk-fbsvc-1e5209bdbb.json"
+REPORT_QUERIES = 200
+REPORT_K = 25
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build IVF ANN artifacts and/or a memory-mappable index snapshot from the Firestore 'items' data.")
+    parser.add_argument("folders", nargs="+", help="folder ids to index, e.g. mygo spongebob")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="write a versioned snapshot of all listed folders and make it CURRENT")
+    parser.add_argument("--no-ann", action="store_true", help="skip building IVF artifacts")
+    parser.add_argument("--nlist", type=int, default=None, help="number of clusters (default: sqrt(rows))")
+    parser.add_argument("--iterations", type=int, default=20, help="k-means iterations")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[ANN_NPROBE],
+                        help="nprobe values to report recall@k for")
+    parser.add_argument("--queries", type=int, default=REPORT_QUERIES, help="corpus rows sampled (and perturbed) as report queries")
+    parser.add_argument("--k", type=int, default=REPORT_K, help="k for the recall@k report")
+    parser.add_argument("--compare-precision", nargs="*", default=[], choices=["float16", "int8"],
+                        help="also report top-k drift of quantized serving matrices against float32")
+    parser.add_argument("--projection-dim", type=int, default=0,
+                        help="learn a reduced-dimension coarse projection (e.g. 128 or 256) over all listed folders")
+    parser.add_argument("--projection-method", choices=["pca", "truncate"], default="pca",
+                        help="pca, or truncate for models trained to be cut to their first dims (not ada-002)")
+    return parser.parse_args()
+
+
+def report(shard, ann, args):
+    # Unmodified corpus rows would always find themselves first and inflate recall.
+    queries = normalize_rows(perturbed_queries(shard, args, 0))
+    print(f"   📊 recall@{args.k} vs exact search ({len(queries)} perturbed queries):")
+    for nprobe in args.nprobe:
+        started = time.perf_counter()
+        for query_vector in queries:
+            rows = ann.candidates(query_vector, nprobe)
+            shard.matrix[rows] @ query_vector
+        ann_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+        started = time.perf_counter()
+        for query_vector in queries:
+            shard.matrix @ query_vector
+        exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+        recall = recall_at_k(shard.matrix, ann, queries, args.k, nprobe)
+        print(f"      nprobe={nprobe:<4} recall={recall:.4f}  ann={ann_ms:.3f} ms/query  exact={exact_ms:.3f} ms/query")
+
+
+def report_precision(shard, args):
+    queries = perturbed_queries(shard, args, 1)
+    for precision in args.compare_precision:
+        drift = compare_precision(shard.matrix, shard.ids, precision, queries, args.k)
+        print(f"   🔬 {precision}: overlap@{args.k}={drift['overlap_at_k']:.4f}  "
+              f"identical={drift['identical_ranking']:.2%}  max score delta={drift['max_score_delta']:.2e}")
+        for source, key in (("Firestore", "resident_bytes"), ("snapshot", "snapshot_resident_bytes")):
+            print(f"      resident when loaded from {source}: {drift[key] / 1e6:.1f} MB "
+                  f"({drift['float32_bytes'] / drift[key]:.1f}x smaller than float32)")
+
+
+def perturbed_queries(shard, args, seed):
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(shard), min(args.queries, len(shard)), replace=False)
+    # Perturb the sampled rows so queries are not trivially their own nearest neighbour.
+    return shard.matrix[sample] + rng.normal(scale=0.02, size=(len(sample), shard.matrix.shape[1]))
+
+
+def build_projection(shards, args):
+    shards = [shard for shard in shards if len(shard) >= 2]
+    if not shards:
+        print("\n⏭️ No folder has enough memes to learn a projection.")
+        return
+    matrix = np.concatenate([shard.matrix for shard in shards])
+    print(f"\n📐 Learning {args.projection_method} projection {matrix.shape[1]} -> {args.projection_dim} dims "
+          f"from {len(matrix)} memes...")
+    started = time.perf_counter()
+    if args.projection_method == "pca":
+        projection = Projection.fit_pca(matrix, args.projection_dim)
+        print(f"   ✅ Done in {time.perf_counter() - started:.1f} s, "
+              f"{projection.explained_variance:.1%} of the variance kept.")
+    else:
+        projection = Projection.truncation(matrix.shape[1], args.projection_dim)
+    projection.save(PROJECTION_PATH)
+    print(f"   💾 Saved {PROJECTION_PATH}")
+
+    for shard in shards:
+        result = compare_projection(shard.matrix, shard.ids, projection, perturbed_queries(shard, args, 2), args.k)
+        print(f"   📊 {shard.folder_id}: recall@{args.k}={result['recall_at_k']:.4f} "
+              f"(shortlist {result['shortlist']})  projected={result['projected_ms']:.3f} ms/query  "
+              f"exact={result['exact_ms']:.3f} ms/query")
+
+
+def main():
+    args = parse_args()
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(FIREBASE_CREDS_PATH))
+    db = firestore.client()
+
+    # Read the version before the data, so a concurrent upload makes the snapshot stale, never wrong.
+    version = read_corpus_version(db)
+    print(f"🔢 Corpus version: {version}")
+
+    shards = []
+    for folder_id in args.folders:
+        print(f"\n📦 Loading folder '{folder_id}' from Firestore...")
+        # Full precision whatever MEME_INDEX_PRECISION says: the snapshot, the IVF training and
+        # the --compare-precision baseline all need the unrounded rows.
+        shard = load_folder_shard(db, folder_id, version, precision="float32")
+        shards.append(shard)
+        if len(shard) < 2:
+            print(f"   ⏭️ Only {len(shard)} memes, nothing to index or compare.")
+            continue
+
+        # Drift checks need no IVF artifact, so they also run with --no-ann.
+        report_precision(shard, args)
+        if args.no_ann:
+            continue
+
+        print(f"   ✨ Clustering {len(shard)} memes...")
+        started = time.perf_counter()
+        ann = IVFIndex.build(shard.matrix, shard.ids, nlist=args.nlist, iterations=args.iterations)
+        print(f"   ✅ {ann.nlist} lists built in {time.perf_counter() - started:.1f} s.")
+
+        path = ann_artifact_path(folder_id)
+        ann.save(path)
+        print(f"   💾 Saved {path}")
+
+        report(shard, ann, args)
+
+    if args.projection_dim:
+        build_projection(shards, args)
+
+    if args.snapshot:
+        path = write_snapshot(shards, version, create_embedding_provider().model)
+        print(f"\n💾 Snapshot of {sum(len(shard) for shard in shards)} memes written to {path} and marked CURRENT.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,29 @@
 import json
-import os
+import sys
+from pathlib import Path
 import numpy as np
-from openai import OpenAI
 from dotenv import load_dotenv
 
-# ✅ 初始化
+# 共用 functions/ 內的查詢 embedding 快取 (SQLite 持久層，重啟後仍可命中) 與 embedding provider
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "functions"))
+from embedding_cache import create_embedding_cache
+from embedding_provider import create_embedding_provider
+
+# ✅ 初始化 (EMBEDDING_BACKEND=hash 可離線測試)
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+embedder = create_embedding_provider()
+query_cache = create_embedding_cache(backend="sqlite")
 
 # ✅ 載入資料
 with open("../assets/images/basic/description/mygo.json", "r", encoding="utf-8") as f:
     memes = json.load(f)
 
-# ✅ 把每筆資料做成 embedding + 保留原始內容
-docs = []
-for key, item in memes.items():
-    text = item["文字"] + "\n" + "\n".join(item["使用案例"])
-
-    response = client.embeddings.create(
-        input=text,
-        model="text-embedding-ada-002"
-    )
-    embedding = response.data[0].embedding
+# ✅ 把每筆資料做成 embedding + 保留原始內容 (整批送出，由 provider 分批與並行)
+texts = {key: item["文字"] + "\n" + "\n".join(item["使用案例"]) for key, item in memes.items()}
+embeddings = embedder.embed_many(texts.values())
 
+docs = []
+for (key, text), embedding in zip(texts.items(), embeddings):
     docs.append({
         "id": key,
         "text": text,
@@ -37,11 +38,7 @@ def cosine_sim(a, b):
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
 def search(query, top_k=4):
-    response = client.embeddings.create(
-        input=query,
-        model="text-embedding-ada-002"
-    )
-    q_vec = response.data[0].embedding
+    q_vec, _ = query_cache.get_or_embed(query, embedder.model, embedder.embed)
 
     sims = [
         (doc["id"], cosine_sim(q_vec, doc["embedding"]), doc["image_path"])
@@ -57,6 +54,7 @@ while True:
         break
 
     results = search(user_input)
+    print(f"(embedding 快取: {query_cache.stats()})")
     print("\n🔍 匹配結果：")
     for i, (id, score, path) in enumerate(results):
         print(f"{i+1}. 圖片 ID: {id}, 相似度: {score:.4f}, 圖片路徑: {path}")
@@ -0,0 +1,211 @@
+# firestore_writer.py
+#
+# Pipelined Firestore writes for the ingest scripts. set()/delete() only queue a write;
+# full batches are committed on a thread pool with up to MAX_IN_FLIGHT batches at once,
+# so embedding the next chunk overlaps the upload of the previous one.
+#
+# Batches go through the batch_write RPC (BulkWriteBatch) rather than an atomic commit:
+# every write gets its own status, so only the writes that failed are retried, with
+# exponential backoff and jitter, instead of the whole batch. Throughput follows
+# Firestore's 500/50/5 rule: start at 500 writes/s and raise the limit by 50% every
+# 5 minutes. Callers wait in set()/delete() once MAX_IN_FLIGHT batches are pending.
+#
+# One writer may be shared by several producer threads (one per folder). Each write can
+# carry a `group` label so failures are counted per group as well as in total.
+
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud.firestore_v1.bulk_batch import BulkWriteBatch
+
+# --- Configuration ---
+# Writes per batch_write request. Each meme carries 1536 floats, so small batches keep
+# requests well below the 10 MiB limit and spread across the in-flight slots.
+WRITE_BATCH_SIZE = 20
+MAX_IN_FLIGHT = 8
+INITIAL_OPS_PER_SECOND = 500
+RAMP_FACTOR = 1.5
+RAMP_INTERVAL_SECONDS = 5 * 60
+MAX_ATTEMPTS = 8
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+
+# google.rpc.Code values worth retrying: contention, overload and timeouts.
+RETRYABLE_CODES = {
+    4,   # DEADLINE_EXCEEDED
+    8,   # RESOURCE_EXHAUSTED
+    10,  # ABORTED
+    13,  # INTERNAL
+    14,  # UNAVAILABLE
+}
+RETRYABLE_ERRORS = (
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.Aborted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+)
+
+
+class RampingRateLimiter:
+    """Writes-per-second token bucket whose rate grows by `ramp_factor` every `ramp_interval`."""
+
+    def __init__(self, initial_rate=INITIAL_OPS_PER_SECOND, ramp_factor=RAMP_FACTOR,
+                 ramp_interval=RAMP_INTERVAL_SECONDS):
+        self.initial_rate = initial_rate
+        self.ramp_factor = ramp_factor
+        self.ramp_interval = ramp_interval
+        self._started = time.monotonic()
+        self._updated = self._started
+        self._tokens = float(initial_rate)
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def rate(self, now=None):
+        elapsed = (now if now is not None else time.monotonic()) - self._started
+        return self.initial_rate * self.ramp_factor ** int(elapsed // self.ramp_interval)
+
+    def acquire(self, writes):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                rate = self.rate(now)
+                self._tokens = min(rate, self._tokens + (now - self._updated) * rate)
+                self._updated = now
+                # A batch larger than one second of budget waits for a full bucket.
+                needed = min(writes, rate)
+                if self._tokens >= needed:
+                    self._tokens -= writes
+                    return
+                wait = (needed - self._tokens) / rate
+                self.waited_seconds += wait
+            time.sleep(wait)
+
+
+class ParallelWriter:
+    def __init__(self, db, batch_size=WRITE_BATCH_SIZE, max_in_flight=MAX_IN_FLIGHT,
+                 rate_limiter=None, max_attempts=MAX_ATTEMPTS):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.rate_limiter = rate_limiter or RampingRateLimiter()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pending = []
+        self._futures = []
+        self._queue_lock = threading.Lock()
+        self._failed_by_group = Counter()
+        self._stats_lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._finished = None
+        self.written = 0
+        self.failed = 0
+        self.retried = 0
+        self.requests = 0
+
+    def set(self, doc_ref, data, merge=False, group=None):
+        self._add(("set", doc_ref, data, merge, group))
+
+    def delete(self, doc_ref, group=None):
+        self._add(("delete", doc_ref, None, False, group))
+
+    def _add(self, write):
+        with self._queue_lock:
+            self._pending.append(write)
+            if len(self._pending) < self.batch_size:
+                return
+            writes, self._pending = self._pending, []
+        self._submit(writes)
+
+    def _submit(self, writes):
+        # Backpressure: block the producer instead of queueing unbounded batches.
+        # The slot is taken outside the queue lock so other producers can keep queueing.
+        self._slots.acquire()
+        future = self._executor.submit(self._commit, writes)
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._queue_lock:
+            self._futures.append(future)
+
+    def flush(self):
+        """Commits everything queued so far (by any thread) and waits for it."""
+        with self._queue_lock:
+            writes, self._pending = self._pending, []
+        if writes:
+            self._submit(writes)
+        with self._queue_lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def failures(self, group):
+        """Writes of `group` that could not be applied so far."""
+        with self._stats_lock:
+            return self._failed_by_group[group]
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown()
+        self._finished = time.perf_counter()
+
+    def _commit(self, writes):
+        for attempt in range(self.max_attempts):
+            self.rate_limiter.acquire(len(writes))
+            with self._stats_lock:
+                self.requests += 1
+            batch = BulkWriteBatch(self.db)
+            for op, doc_ref, data, merge, _ in writes:
+                if op == "delete":
+                    batch.delete(doc_ref)
+                else:
+                    batch.set(doc_ref, data, merge=merge)
+            try:
+                statuses = batch.commit().status
+            except RETRYABLE_ERRORS as e:
+                retry, error = writes, e
+            except Exception as e:
+                print(f"   ❌ An unexpected error occurred during commit: {e}")
+                self._count(failed=writes)
+                return
+            else:
+                retry, error = [], None
+                for write, status in zip(writes, statuses):
+                    if status.code == 0:
+                        continue
+                    if status.code in RETRYABLE_CODES:
+                        retry.append(write)
+                        error = status.message
+                    else:
+                        print(f"   ❌ Write to '{write[1].path}' failed: {status.message}")
+                        self._count(failed=[write])
+                self._count(written=sum(1 for status in statuses if status.code == 0))
+
+            if not retry:
+                return
+            if attempt + 1 == self.max_attempts:
+                break
+            delay = min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** attempt) * (0.5 + random.random())
+            print(f"   ⚠️ {len(retry)} of {len(writes)} writes not applied ({error}). "
+                  f"Retrying in {delay:.1f}s... (Attempt {attempt + 1}/{self.max_attempts})")
+            self._count(retried=len(retry))
+            writes = retry
+            time.sleep(delay)
+
+        print(f"   ❌ Failed to apply {len(retry)} writes after {self.max_attempts} attempts.")
+        self._count(failed=retry)
+
+    def _count(self, written=0, failed=(), retried=0):
+        with self._stats_lock:
+            self.written += written
+            self.failed += len(failed)
+            self._failed_by_group.update(write[4] for write in failed)
+            self.retried += retried
+
+    def report(self):
+        seconds = (self._finished or time.perf_counter()) - self._started
+        return (f"{self.written} writes in {seconds:.1f}s ({self.written / max(seconds, 1e-9):.0f} writes/s, "
+                f"{self.requests} requests, {self.retried} retried, "
+                f"{self.rate_limiter.waited_seconds:.1f}s throttled)")
@@ -0,0 +1,82 @@
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+# Phases in the order a search runs through them; anything else is listed after these.
+PHASE_ORDER = ["embed", "version", "load", "lexical", "score", "merge", "serialize", "total"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Aggregate request_timing log lines from the search functions into per-phase percentiles.")
+    parser.add_argument("logs", nargs="*",
+                        help="log files (plain `firebase functions:log` output or a Cloud Logging JSON export); "
+                             "reads stdin when omitted")
+    parser.add_argument("--function", help="only report this function, e.g. find_similar_memes_v2")
+    parser.add_argument("--include-errors", action="store_true", help="also count non-2xx responses")
+    return parser.parse_args()
+
+
+def timing_events(lines):
+    """Yields request_timing events from log lines, whatever prefix the log viewer put in front."""
+    for line in lines:
+        start = line.find("{")
+        if start < 0:
+            continue
+        try:
+            event = json.loads(line[start:])
+        except ValueError:
+            continue
+        # Cloud Logging exports wrap the printed JSON in jsonPayload.
+        if isinstance(event, dict) and isinstance(event.get("jsonPayload"), dict):
+            event = event["jsonPayload"]
+        if isinstance(event, dict) and event.get("event") == "request_timing":
+            yield event
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def read_lines(paths):
+    if not paths:
+        yield from sys.stdin
+        return
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            yield from f
+
+
+def main():
+    args = parse_args()
+
+    phases_by_function = defaultdict(lambda: defaultdict(list))
+    for event in timing_events(read_lines(args.logs)):
+        if args.function and event.get("function") != args.function:
+            continue
+        if not args.include_errors and not 200 <= event.get("status", 200) < 300:
+            continue
+        phases = phases_by_function[event.get("function", "?")]
+        for name, ms in event.get("spans", {}).items():
+            phases[name].append(ms)
+        phases["total"].append(event["total_ms"])
+
+    if not phases_by_function:
+        print("No request_timing lines found.")
+        return
+
+    for function, phases in sorted(phases_by_function.items()):
+        requests = len(phases["total"])
+        print(f"\n📊 {function} ({requests} requests)")
+        print(f"{'phase':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        names = sorted(phases, key=lambda name: (PHASE_ORDER.index(name) if name in PHASE_ORDER else len(PHASE_ORDER), name))
+        for name in names:
+            values = phases[name]
+            print(f"{name:<12}{len(values):>8}{percentile(values, 0.50):>10.1f}{percentile(values, 0.95):>10.1f}"
+                  f"{percentile(values, 0.99):>10.1f}{max(values):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,141 +1,265 @@
+import argparse
+import hashlib
 import json
-import os
+import sys
+import threading
 import time
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from dotenv import load_dotenv
 import firebase_admin
 from firebase_admin import credentials, firestore
-from google.api_core import exceptions as google_exceptions
+
+# Shared with the search function so documents and queries use the same embedding backend
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "functions"))
+from embedding_provider import create_embedding_provider
+from firestore_writer import ParallelWriter
+
+# scripts/dedup_images.py writes each image folder's near-duplicate table
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+from dedup_images import DUPLICATES_FILE, load_duplicates
 
 # --- Configuration ---
-BATCH_SIZE = 25
-FOLDER_NAME = "spongebob" # Change this to "popular" for the other file
-MEME_JSON_PATH = f"{FOLDER_NAME}.json"
+# Memes embedded per round; a multiple of EMBEDDING_BATCH_SIZE keeps every worker busy
+EMBED_CHUNK_SIZE = 1024
+# Document references fetched per page when listing the ids already in the folder
+LIST_PAGE_SIZE = 1000
+# Folders ingested at once. They share one embedding provider (and its RPM/TPM budget) and
+# one Firestore writer (and its write ramp-up), so more folders do not mean more quota.
+FOLDER_PARALLELISM = 4
+# Refuse to delete more than this share of a folder in one run (guards against a truncated JSON)
+MAX_DELETE_FRACTION = 0.5
+# Model of documents uploaded before content hashes were stored
+LEGACY_EMBEDDING_MODEL = "text-embedding-ada-002"
 
-# <<< CHANGE 1 of 2 >>> Define the top-level and sub-collection names
 TOP_COLLECTION_NAME = "memes2"
 SUB_COLLECTION_NAME = "items" # Let's use 'items' for clarity
 
+# Version counter watched by the search function to refresh its in-memory index
+CORPUS_META_COLLECTION = "meta"
+CORPUS_META_DOCUMENT = "corpus"
+
 FIREBASE_CREDS_PATH = "./ai-meme-suggestion-firebase-adminsdk-fbsvc-1e5209bdbb.json"
-EMBEDDING_MODEL = "text-embedding-ada-002"
-
-# --- Initialization (No changes here) ---
-print("🔧 Loading environment variables...")
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-print("🔐 OpenAI client initialized.")
-
-if not firebase_admin._apps:
-    cred = credentials.Certificate(FIREBASE_CREDS_PATH)
-    firebase_admin.initialize_app(cred)
-    print("🚀 Firebase App Initialized.")
-else:
-    print("✅ Firebase App already initialized.")
-db = firestore.client()
-print("📦 Firebase Firestore client ready.")
-
-# ... (Loading JSON and commit_batch_with_retry function remain the same) ...
-# ...
-with open(MEME_JSON_PATH, "r", encoding="utf-8") as f:
-    memes = json.load(f)
-total_memes = len(memes)
-print(f"🧠 Loaded {total_memes} memes from file.")
-
-def commit_batch_with_retry(batch_to_commit, max_retries=5):
-    # ... (no changes)
-    for attempt in range(max_retries):
+# Image folders, one per folder id; dedup_images.py leaves duplicates.json in each
+IMAGES_ROOT = Path(__file__).resolve().parent.parent / "assets" / "images"
+
+_print_lock = threading.Lock()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=f"Embed meme description files and sync them to Firestore '{TOP_COLLECTION_NAME}/<folder>/"
+                    f"{SUB_COLLECTION_NAME}'. All folders share one embedding provider, rate budget and writer.")
+    parser.add_argument("folders", nargs="+", metavar="FOLDER[=JSON]",
+                        help="folder id and its description file, e.g. mygo=../assets/images/mygo/description/mygo.json "
+                             "(default file: <folder>.json)")
+    parser.add_argument("--mode", choices=["sync", "add"], default="sync",
+                        help="sync: also re-embed changed memes and delete removed ones; add: only upload new ids")
+    parser.add_argument("--parallel", type=int, default=FOLDER_PARALLELISM, help="folders ingested at once")
+    parser.add_argument("--max-delete-fraction", type=float, default=MAX_DELETE_FRACTION,
+                        help="refuse to delete more than this share of a folder")
+    parser.add_argument("--creds", default=FIREBASE_CREDS_PATH, help="Firebase service account JSON")
+    parser.add_argument("--images-root", type=Path, default=IMAGES_ROOT,
+                        help=f"directory holding <folder>/{DUPLICATES_FILE} from scripts/dedup_images.py")
+    return parser.parse_args()
+
+
+def parse_folder(spec):
+    folder, _, json_path = spec.partition("=")
+    return folder, Path(json_path or f"{folder}.json")
+
+
+def log(folder, message):
+    with _print_lock:
+        print(f"[{folder}] {message}", flush=True)
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def load_memes(folder, json_path, images_root):
+    with open(json_path, "r", encoding="utf-8") as f:
+        memes = json.load(f)
+
+    # Output of scripts/dedup_images.py for this folder's images; duplicate ids are not uploaded
+    duplicates_path = images_root / folder / DUPLICATES_FILE
+    duplicates = load_duplicates(duplicates_path)
+    if duplicates:
+        skipped_duplicates = [key for key in memes if key in duplicates]
+        for key in skipped_duplicates:
+            del memes[key]
+        log(folder, f"🪞 Dropped {len(skipped_duplicates)} near-duplicate memes listed in '{duplicates_path}'.")
+    elif not duplicates_path.exists():
+        log(folder, f"🪞 No '{duplicates_path}' (run scripts/dedup_images.py on the images to skip duplicates).")
+
+    log(folder, f"🧠 Loaded {len(memes)} memes from '{json_path}'.")
+    return {key: item["文字"] + "\n" + "\n".join(item["使用案例"]) for key, item in memes.items()}
+
+
+def read_manifest(db, items_ref, texts, mode):
+    """What Firestore holds for the folder: id -> (content_hash, embedding_model), or id -> None in "add" mode."""
+    # "sync" reads only content_hash/embedding_model (never the 1536 floats); "add" lists
+    # document ids, keys only, LIST_PAGE_SIZE per round trip.
+    if mode == "sync":
+        remote = {}
+        for snapshot in items_ref.select(["content_hash", "embedding_model"]).stream():
+            data = snapshot.to_dict()
+            remote[snapshot.id] = (data.get("content_hash"), data.get("embedding_model"))
+    else:
+        remote = {doc_ref.id: None for doc_ref in items_ref.list_documents(page_size=LIST_PAGE_SIZE)}
+
+    # Documents written before content hashes existed: compare their stored description once,
+    # and only backfill the hash when the text still matches.
+    legacy_ids = [key for key in texts if remote.get(key) is not None and remote[key][0] is None]
+    legacy_descriptions = {}
+    for start in range(0, len(legacy_ids), LIST_PAGE_SIZE):
+        refs = [items_ref.document(key) for key in legacy_ids[start:start + LIST_PAGE_SIZE]]
+        for snapshot in db.get_all(refs, field_paths=["description"]):
+            if snapshot.exists:
+                legacy_descriptions[snapshot.id] = snapshot.to_dict().get("description")
+    return remote, legacy_descriptions
+
+
+def ingest_folder(folder, json_path, db, embedder, writer, args):
+    """Diffs one folder against Firestore and queues its writes. Returns the folder's counts."""
+    started = time.perf_counter()
+    texts = load_memes(folder, json_path, args.images_root)
+    items_ref = db.collection(TOP_COLLECTION_NAME).document(folder).collection(SUB_COLLECTION_NAME)
+    remote, legacy_descriptions = read_manifest(db, items_ref, texts, args.mode)
+    log(folder, f"🔎 Found {len(remote)} memes already in Firestore in {time.perf_counter() - started:.1f}s.")
+
+    # New and changed memes are (re-)embedded, unchanged ones skipped.
+    stats = {"new": 0, "changed": 0, "removed": 0, "backfilled": 0, "unchanged": 0, "failed": 0}
+    backfill, pending = [], []
+    for key, text in texts.items():
+        text_hash = content_hash(text)
+        if key not in remote:
+            stats["new"] += 1
+        elif remote[key] is None:
+            stats["unchanged"] += 1
+            continue
+        else:
+            stored_hash, stored_model = remote[key]
+            if stored_hash is None and legacy_descriptions.get(key) == text and embedder.model == LEGACY_EMBEDDING_MODEL:
+                backfill.append((key, text_hash))
+                continue
+            if stored_hash == text_hash and stored_model == embedder.model:
+                stats["unchanged"] += 1
+                continue
+            stats["changed"] += 1
+        pending.append((key, items_ref.document(key), text, text_hash))
+
+    removed_ids = [key for key in remote if key not in texts] if args.mode == "sync" else []
+    if remote and len(removed_ids) > args.max_delete_fraction * len(remote):
+        log(folder, f"   🛑 Refusing to delete {len(removed_ids)} of {len(remote)} memes "
+                    f"(over {args.max_delete_fraction:.0%}). Check '{json_path}' or raise --max-delete-fraction.")
+        removed_ids = []
+    stats["removed"] = len(removed_ids)
+    stats["backfilled"] = len(backfill)
+    log(folder, f"📋 Diff: {stats['new']} new, {stats['changed']} changed, {len(removed_ids)} removed, "
+                f"{len(backfill)} to tag with a content hash, {stats['unchanged']} unchanged.")
+
+    # Embed in multi-input requests, EMBED_CHUNK_SIZE texts at a time. The shared provider caps
+    # requests in flight across all folders; writes upload in the background meanwhile.
+    for start in range(0, len(pending), EMBED_CHUNK_SIZE):
+        chunk = pending[start:start + EMBED_CHUNK_SIZE]
+        log(folder, f"✨ Generating embeddings for memes {start + 1}-{start + len(chunk)} of {len(pending)}...")
         try:
-            batch_to_commit.commit()
-            return True # Success
-        except google_exceptions.Aborted as e:
-            print(f"   ⚠️ Firestore contention detected. Retrying... (Attempt {attempt + 1}/{max_retries})")
-            time.sleep(2 ** attempt)
+            embeddings = embedder.embed_many([text for _, _, text, _ in chunk])
         except Exception as e:
-            print(f"   ❌ An unexpected error occurred during commit: {e}")
-            return False # Unrecoverable error
-    
-    print(f"   ❌ Failed to commit batch after {max_retries} attempts.")
-    return False
-
-
-# --- Main Processing Loop ---
-print(f"\n🚀 Starting to process and upload meme data to Firestore at '{TOP_COLLECTION_NAME}/{FOLDER_NAME}'...")
-batch = db.batch()
-# ... (variable initializations are the same)
-total_processed = 0
-total_skipped = 0
-total_failed = 0
-items_in_current_batch = 0
-
-for idx, (key, item) in enumerate(list(memes.items()), start=1):
-    # <<< CHANGE 2 of 2 >>> Construct the new, correct path
-    doc_ref = db.collection(TOP_COLLECTION_NAME).document(FOLDER_NAME).collection(SUB_COLLECTION_NAME).document(key)
-
-    if doc_ref.get().exists:
-        print(f"➡️ [{idx}/{total_memes}] SKIPPING: Meme '{key}' already exists in folder '{FOLDER_NAME}'.")
-        total_skipped += 1
-        continue
-
-    # ... (The rest of the loop is exactly the same, it correctly adds 'folder_id') ...
-    # ...
-    print(f"➡️ [{idx}/{total_memes}] PROCESSING: Meme '{key}' for folder '{FOLDER_NAME}'")
-    text = item["文字"] + "\n" + "\n".join(item["使用案例"])
-
-    try:
-        print("   ✨ Generating embedding...")
-        response = client.embeddings.create(input=text, model=EMBEDDING_MODEL)
-        embedding = response.data[0].embedding
-        print("   ✅ Embedding generated.")
-
-        data = {
-            "id": key,
-            "description": text,
-            "embedding": embedding,
-            "folder_id": FOLDER_NAME, # Still correct and essential!
-        }
-
-        batch.set(doc_ref, data)
-        items_in_current_batch += 1
-        print(f"   📥 Added '{key}' to batch. (Batch size: {items_in_current_batch}/{BATCH_SIZE})")
-
-    except Exception as e:
-        print(f"   ❌ ERROR processing '{key}': {e}")
-        print("   Skipping this item and continuing.")
-        total_failed += 1
-        continue
-
-    # Commit batch when full
-    if items_in_current_batch >= BATCH_SIZE:
-        print(f"\n💾 Committing batch of {items_in_current_batch} items...")
-        
-        if commit_batch_with_retry(batch):
-            print("   ✅ Batch committed successfully.")
-            total_processed += items_in_current_batch
-        else:
-            print("   🛑 CRITICAL: Could not commit batch. Stopping script to avoid data loss.")
-            total_failed += items_in_current_batch
-            break 
-        
-        batch = db.batch()
-        items_in_current_batch = 0
-
-
-# --- Final Commit (no changes needed here) ---
-# ...
-if items_in_current_batch > 0:
-    print(f"\n💾 Committing final batch of {items_in_current_batch} items...")
-    
-    if commit_batch_with_retry(batch):
-        print("   ✅ Final batch committed successfully.")
-        total_processed += items_in_current_batch
-    else:
-        print("   🛑 CRITICAL: Could not commit the final batch.")
-        total_failed += items_in_current_batch
-else:
-    print("\nNo remaining items to commit in the final batch.")
+            log(folder, f"   ❌ ERROR embedding this chunk: {e}. Skipping these items and continuing.")
+            stats["failed"] += len(chunk)
+            continue
+
+        for (key, doc_ref, text, text_hash), embedding in zip(chunk, embeddings):
+            writer.set(doc_ref, {
+                "id": key,
+                "description": text,
+                "embedding": embedding,
+                "folder_id": folder, # Still correct and essential!
+                "content_hash": text_hash,
+                "embedding_model": embedder.model,
+            }, group=folder)
+        if writer.failures(folder):
+            log(folder, "   🛑 CRITICAL: Some writes of this folder could not be applied. Stopping to avoid data loss.")
+            return stats
+
+    for key, text_hash in backfill:
+        writer.set(items_ref.document(key),
+                   {"content_hash": text_hash, "embedding_model": LEGACY_EMBEDDING_MODEL}, merge=True, group=folder)
+    for key in removed_ids:
+        log(folder, f"🗑️ Deleting meme '{key}' (no longer in '{json_path}').")
+        writer.delete(items_ref.document(key), group=folder)
+
+    log(folder, f"✅ Queued all writes in {time.perf_counter() - started:.1f}s.")
+    return stats
+
+
+def main():
+    args = parse_args()
+    folders = [parse_folder(spec) for spec in args.folders]
+
+    print("🔧 Loading environment variables...")
+    load_dotenv()
+    embedder = create_embedding_provider()
+    print(f"🔐 Embedding provider ready (model: {embedder.model}, {embedder.batch_size} per request, "
+          f"{embedder.max_concurrency} requests in flight).")
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(args.creds))
+        print("🚀 Firebase App Initialized.")
+    db = firestore.client()
+    print("📦 Firebase Firestore client ready.")
+
+    print(f"\n🚀 Starting to {args.mode} {len(folders)} folders to Firestore at '{TOP_COLLECTION_NAME}' "
+          f"({min(args.parallel, len(folders))} at a time)...")
+    started = time.perf_counter()
+    # Commits run in the background, so the next chunk is embedded while the last one uploads.
+    writer = ParallelWriter(db)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(args.parallel, len(folders)))) as executor:
+        futures = {folder: executor.submit(ingest_folder, folder, json_path, db, embedder, writer, args)
+                   for folder, json_path in folders}
+        for folder, future in futures.items():
+            try:
+                results[folder] = future.result()
+            except Exception as e:
+                log(folder, f"❌ Folder failed: {e}")
+                results[folder] = None
+
+    print("\n💾 Waiting for the remaining writes...")
+    writer.close()
+    seconds = time.perf_counter() - started
+    # Writes are committed in the background, so a folder's failures are only known now.
+    for folder, stats in results.items():
+        if stats is not None:
+            stats["failed"] += writer.failures(folder)
+
+    # --- Bump the corpus version once so warm search instances reload the changed folders ---
+    if writer.written > 0:
+        db.collection(CORPUS_META_COLLECTION).document(CORPUS_META_DOCUMENT).set(
+            {"version": firestore.Increment(1), "updated_at": firestore.SERVER_TIMESTAMP},
+            merge=True,
+        )
+        print(f"🔄 Corpus version bumped in '{CORPUS_META_COLLECTION}/{CORPUS_META_DOCUMENT}'.")
+
+    print("\n--- 🏁 All Done! ---")
+    print(f"{'folder':<16}{'new':>8}{'changed':>9}{'removed':>9}{'tagged':>8}{'unchanged':>11}{'failed':>8}")
+    for folder, stats in results.items():
+        if stats is None:
+            print(f"{folder:<16}{'(failed, see log above)':>53}")
+            continue
+        print(f"{folder:<16}{stats['new']:>8}{stats['changed']:>9}{stats['removed']:>9}{stats['backfilled']:>8}"
+              f"{stats['unchanged']:>11}{stats['failed']:>8}")
+    embedded = sum(stats["new"] + stats["changed"] for stats in results.values() if stats)
+    print(f"⏱️  Total time: {seconds:.1f}s ({embedder.requests} embedding requests, "
+          f"{embedded / max(seconds, 1e-9):.1f} memes/s)")
+    print(f"📤 Firestore writes: {writer.report()}")
+    if writer.failed or any(stats is None or stats["failed"] for stats in results.values()):
+        print(f"❌ {writer.failed} writes failed; re-run to retry them (sync only redoes what is still missing).")
+        sys.exit(1)
 
 
-print("\n--- 🏁 All Done! ---")
-print(f"✅ Total items successfully processed and uploaded: {total_processed}")
-print(f"⏭️  Total items skipped (already existed): {total_skipped}")
-print(f"❌ Total items failed (due to errors or commit failures): {total_failed}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
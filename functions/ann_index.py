@@ -0,0 +1,147 @@
+# ann_index.py
+#
+# Inverted-file (IVF) approximate nearest-neighbour index for large folders.
+# Rows are clustered offline with spherical k-means (backend/build_index.py); a query
+# only scores the rows of its `nprobe` closest clusters instead of the whole folder.
+# Folders below ANN_MIN_ROWS, or whose artifact no longer matches the loaded rows,
+# keep using the exact matrix product.
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+# --- Configuration ---
+INDEX_DIR = Path(os.environ.get("MEME_INDEX_DIR", Path(__file__).resolve().parent / "index"))
+ANN_DIR = INDEX_DIR / "ann"
+# Folders with fewer rows than this are always searched exactly.
+ANN_MIN_ROWS = int(os.environ.get("ANN_MIN_ROWS", "5000"))
+# Clusters scanned per query: higher means better recall and slower queries.
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", "8"))
+
+ASSIGN_CHUNK_ROWS = 8192
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def _assign(matrix, centroids):
+    labels = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), ASSIGN_CHUNK_ROWS):
+        chunk = matrix[start:start + ASSIGN_CHUNK_ROWS]
+        labels[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+
+def default_nlist(num_rows):
+    return max(1, int(np.sqrt(num_rows)))
+
+
+def spherical_kmeans(matrix, nlist, iterations=20, train_size=100_000, seed=0):
+    rng = np.random.default_rng(seed)
+    train = matrix
+    if len(matrix) > train_size:
+        train = matrix[rng.choice(len(matrix), train_size, replace=False)]
+
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, train)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters with random rows so every list stays useful.
+            sums[empty] = train[rng.choice(len(train), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, ids, centroids, list_offsets, list_rows):
+        self.ids = list(ids)
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix, ids, nlist=None, iterations=20, seed=0):
+        """Clusters row-normalized `matrix`; rows are referenced by their position in `ids`."""
+        nlist = min(nlist or default_nlist(len(matrix)), len(matrix))
+        centroids = spherical_kmeans(matrix, nlist, iterations=iterations, seed=seed)
+        labels = _assign(matrix, centroids)
+        list_rows = np.argsort(labels, kind="stable").astype(np.int32)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))]).astype(np.int64)
+        return cls(ids, centroids, list_offsets, list_rows)
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                ids=np.asarray(self.ids, dtype=str),
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_rows=self.list_rows,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["ids"].tolist(), data["centroids"], data["list_offsets"], data["list_rows"])
+
+    def remap(self, ids):
+        """Re-targets list rows to another row order; returns None if the id sets differ."""
+        if len(ids) != len(self.ids):
+            return None
+        position = {meme_id: row for row, meme_id in enumerate(ids)}
+        try:
+            new_rows = np.asarray([position[meme_id] for meme_id in self.ids], dtype=np.int32)
+        except KeyError:
+            return None
+        return IVFIndex(ids, self.centroids, self.list_offsets, new_rows[self.list_rows])
+
+    def candidates(self, query_vector, nprobe=ANN_NPROBE):
+        nprobe = min(nprobe, self.nlist)
+        probe = np.argpartition(-(self.centroids @ query_vector), nprobe - 1)[:nprobe]
+        return np.concatenate([
+            self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe
+        ])
+
+
+def ann_artifact_path(folder_id):
+    return ANN_DIR / f"{folder_id}.npz"
+
+
+def load_ann_for(folder_id, ids):
+    """Loads the folder's IVF artifact aligned to `ids`, or None to stay on exact search."""
+    if len(ids) < ANN_MIN_ROWS:
+        return None
+    path = ann_artifact_path(folder_id)
+    if not path.exists():
+        return None
+    ann = IVFIndex.load(path).remap(ids)
+    if ann is None:
+        print(f"ANN artifact for '{folder_id}' does not match the loaded rows; using exact search.")
+    return ann
+
+
+def recall_at_k(matrix, ann, queries, k, nprobe=ANN_NPROBE):
+    """Mean fraction of the exact top-k that the IVF search also returns."""
+    found = 0
+    for query_vector in queries:
+        exact_scores = matrix @ query_vector
+        exact = np.argpartition(-exact_scores, k - 1)[:k] if k < len(matrix) else np.arange(len(matrix))
+        rows = ann.candidates(query_vector, nprobe)
+        scores = matrix[rows] @ query_vector
+        approx = rows[np.argpartition(-scores, k - 1)[:k]] if k < len(rows) else rows
+        found += len(np.intersect1d(exact, approx))
+    return found / (len(queries) * min(k, len(matrix)))
@@ -0,0 +1,214 @@
+# embedding_cache.py
+#
+# Cache in front of client.embeddings.create for search queries.
+# The first tier is an in-process LRU+TTL cache. The optional second tier is shared
+# between instances and restarts: a Firestore collection for the Cloud Function or a
+# local SQLite file for the backend scripts.
+#
+# Reads of the persistent tier happen on the request path (a hit saves the embedding
+# call); writes can go to an `executor` so a miss does not also wait for the store.
+# Firestore entries carry an `expires_at` timestamp; enable a TTL policy on it once per
+# project so expired entries are deleted instead of accumulating:
+#
+#   gcloud firestore fields ttls update expires_at --collection-group=embedding_cache --enable-ttl
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from ttl_cache import TTLCache
+
+# --- Configuration ---
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# "firestore", "sqlite" or "none"
+EMBEDDING_CACHE_BACKEND = os.environ.get("EMBEDDING_CACHE_BACKEND", "firestore")
+EMBEDDING_CACHE_COLLECTION = os.environ.get("EMBEDDING_CACHE_COLLECTION", "embedding_cache")
+EMBEDDING_CACHE_SQLITE_PATH = os.environ.get("EMBEDDING_CACHE_SQLITE_PATH", "embedding_cache.sqlite3")
+
+
+def normalize_query(text):
+    """NFKC-folds, lower-cases and collapses whitespace so trivial variants share an entry."""
+    return " ".join(unicodedata.normalize("NFKC", text).split()).lower()
+
+
+def cache_key(text, model):
+    return hashlib.sha256(f"{model}\n{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+
+def _to_vector(values):
+    vector = np.asarray(values, dtype=np.float32)
+    vector.flags.writeable = False
+    return vector
+
+
+class FirestoreEmbeddingStore:
+    def __init__(self, get_db, collection=EMBEDDING_CACHE_COLLECTION, ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS):
+        # `get_db` returns the Firestore client; it is only called once the store is used.
+        self._get_db = get_db
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    def _document(self, key):
+        return self._get_db().collection(self.collection).document(key)
+
+    def get(self, key):
+        snapshot = self._document(key).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        if time.time() - data.get("created_at", 0) > self.ttl_seconds:
+            return None
+        return _to_vector(np.frombuffer(data["embedding"], dtype=np.float32))
+
+    def put(self, key, model, vector):
+        self._document(key).set({
+            "embedding": np.asarray(vector, dtype=np.float32).tobytes(),
+            "model": model,
+            "created_at": time.time(),
+            # Firestore's TTL policy deletes the document some time after this.
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds),
+        })
+
+
+class SQLiteEmbeddingStore:
+    def __init__(self, path=EMBEDDING_CACHE_SQLITE_PATH, ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT, embedding BLOB, created_at REAL)"
+            )
+            # Entries only expire when read, so drop the stale ones on open.
+            self._conn.execute("DELETE FROM embeddings WHERE created_at < ?", (time.time() - ttl_seconds,))
+            self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT embedding, created_at FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            return None
+        return _to_vector(np.frombuffer(row[0], dtype=np.float32))
+
+    def put(self, key, model, vector):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, model, embedding, created_at) VALUES (?, ?, ?, ?)",
+                (key, model, np.asarray(vector, dtype=np.float32).tobytes(), time.time()),
+            )
+            self._conn.commit()
+
+
+class EmbeddingCache:
+    """Two-tier query embedding cache keyed by (normalized text, model).
+
+    With an `executor`, new entries are written to the persistent store in the background.
+    """
+
+    def __init__(self, store=None, max_entries=EMBEDDING_CACHE_SIZE, ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS,
+                 executor=None):
+        self._memory = TTLCache(max_entries, ttl_seconds)
+        self._store = store
+        self._executor = executor
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def get_or_embed(self, text, model, embed):
+        """Returns (vector, source) where source is "memory", "persistent" or "miss".
+
+        `embed(text)` is only called on a miss and must return the embedding values.
+        """
+        key = cache_key(text, model)
+        vector, source = self._lookup(key)
+        if vector is not None:
+            return vector, source
+
+        self.misses += 1
+        return self._remember(key, model, embed(text)), "miss"
+
+    def get_or_embed_many(self, texts, model, embed_many):
+        """Batch version of get_or_embed returning a list of (vector, source) pairs.
+
+        All misses are passed to a single `embed_many(list_of_texts)` call, which must
+        return one embedding per text in the same order.
+        """
+        results = [None] * len(texts)
+        missing = {}
+        for i, text in enumerate(texts):
+            key = cache_key(text, model)
+            if key in missing:
+                missing[key].append(i)
+                continue
+            vector, source = self._lookup(key)
+            if vector is None:
+                missing[key] = [i]
+            else:
+                results[i] = (vector, source)
+
+        if missing:
+            self.misses += len(missing)
+            embedded = embed_many([texts[positions[0]] for positions in missing.values()])
+            for (key, positions), values in zip(missing.items(), embedded):
+                vector = self._remember(key, model, values)
+                for i in positions:
+                    results[i] = (vector, "miss")
+        return results
+
+    def _lookup(self, key):
+        vector = self._memory.get(key)
+        if vector is not None:
+            return vector, "memory"
+
+        if self._store is not None:
+            try:
+                vector = self._store.get(key)
+            except Exception as e:
+                print(f"Embedding cache read failed: {e}")
+            if vector is not None:
+                self.persistent_hits += 1
+                self._memory.put(key, vector)
+                return vector, "persistent"
+        return None, None
+
+    def _remember(self, key, model, values):
+        vector = _to_vector(values)
+        self._memory.put(key, vector)
+        if self._store is not None:
+            if self._executor is not None:
+                self._executor.submit(self._store_put, key, model, vector)
+            else:
+                self._store_put(key, model, vector)
+        return vector
+
+    def _store_put(self, key, model, vector):
+        try:
+            self._store.put(key, model, vector)
+        except Exception as e:
+            print(f"Embedding cache write failed: {e}")
+
+    def stats(self):
+        memory = self._memory.stats()
+        return {
+            "memory_hits": memory["hits"],
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "size": memory["size"],
+        }
+
+
+def create_embedding_cache(get_db=None, backend=EMBEDDING_CACHE_BACKEND, executor=None):
+    if backend == "firestore" and get_db is not None:
+        return EmbeddingCache(FirestoreEmbeddingStore(get_db), executor=executor)
+    if backend == "sqlite":
+        return EmbeddingCache(SQLiteEmbeddingStore())
+    return EmbeddingCache()
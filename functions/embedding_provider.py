@@ -0,0 +1,273 @@
+# embedding_provider.py
+#
+# The one place that turns text into embeddings, shared by the Cloud Function
+# (main.py) and the backend scripts (populate_firestore.py, embed_and_upload.py).
+#
+#   EMBEDDING_BACKEND=openai  OpenAI embeddings API (default, EMBEDDING_MODEL)
+#   EMBEDDING_BACKEND=hash    deterministic vectors seeded from the text's SHA-256; no
+#                             network, no semantics. For offline tests and benchmarks.
+#   EMBEDDING_BACKEND=local   sentence-transformers model on the CPU (LOCAL_EMBEDDING_MODEL,
+#                             optional dependency, not in requirements.txt)
+#
+# embed_many() splits its input into batches of EMBEDDING_BATCH_SIZE and runs them on up
+# to EMBEDDING_MAX_CONCURRENCY threads. That limit also holds across callers, because
+# every API call takes the provider's semaphore. OpenAI calls also wait on a
+# requests/tokens-per-minute budget (EMBEDDING_RPM / EMBEDDING_TPM, 0 = unlimited), so
+# a large ingest stays under quota instead of living on 429s. Rate-limit and transient
+# errors that still happen are retried with exponential backoff and jitter; the
+# semaphore is released while a call sleeps, so a backoff never blocks other callers.
+# The OpenAI client is created with max_retries=0 so retries are not nested.
+#
+# The ingest scripts use the batch profile above. The search function uses the serving
+# profile (create_embedding_provider(serving_concurrency=...)): one slot per concurrent
+# request and at most SERVING_MAX_RETRIES short retries, since a query has a deadline.
+#
+# A corpus and its queries must be embedded by the same provider: `model` is what the
+# embedding cache keys on and what the ingest scripts store next to each vector.
+
+import hashlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# --- Configuration ---
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "openai")
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-ada-002")
+HASH_EMBEDDING_DIM = int(os.environ.get("HASH_EMBEDDING_DIM", "1536"))
+LOCAL_EMBEDDING_MODEL = os.environ.get("LOCAL_EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+# Inputs per embeddings request (OpenAI accepts up to 2048) and requests in flight.
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", "6"))
+EMBEDDING_BACKOFF_SECONDS = float(os.environ.get("EMBEDDING_BACKOFF_SECONDS", "1.0"))
+EMBEDDING_MAX_BACKOFF_SECONDS = float(os.environ.get("EMBEDDING_MAX_BACKOFF_SECONDS", "60"))
+SERVING_MAX_RETRIES = int(os.environ.get("EMBEDDING_SERVING_MAX_RETRIES", "2"))
+SERVING_BACKOFF_SECONDS = 0.25
+SERVING_MAX_BACKOFF_SECONDS = 1.0
+# Account quota for the embedding model (defaults: OpenAI tier 1 for ada-002).
+EMBEDDING_RPM = int(os.environ.get("EMBEDDING_RPM", "3000"))
+EMBEDDING_TPM = int(os.environ.get("EMBEDDING_TPM", "1000000"))
+
+
+def estimate_tokens(texts):
+    """Upper-bound-ish token count without a tokenizer: one token per character, which
+    over-counts English and is about right for Traditional Chinese."""
+    return sum(len(text) for text in texts)
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, each starting full.
+
+    acquire() blocks until both buckets can pay for the call. A single call larger than
+    the whole token budget waits for a full bucket instead of forever.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def acquire(self, tokens=0):
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._updated
+                self._updated = now
+                if self.requests_per_minute:
+                    self._requests = min(self.requests_per_minute,
+                                         self._requests + elapsed * self.requests_per_minute / 60)
+                if self.tokens_per_minute:
+                    self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+                wait = 0.0
+                if self.requests_per_minute and self._requests < 1:
+                    wait = (1 - self._requests) * 60 / self.requests_per_minute
+                if self.tokens_per_minute and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+                if wait == 0.0:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                self.waited_seconds += wait
+            time.sleep(wait)
+
+
+class EmbeddingProvider:
+    """Batching, bounded concurrency and retries; subclasses implement _embed_batch(texts)
+    and say which errors are worth retrying in _is_retryable(error)."""
+
+    model = None
+
+    def __init__(self, batch_size=EMBEDDING_BATCH_SIZE, max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+                 max_retries=EMBEDDING_MAX_RETRIES, backoff_seconds=EMBEDDING_BACKOFF_SECONDS,
+                 max_backoff_seconds=EMBEDDING_MAX_BACKOFF_SECONDS):
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.requests = 0
+        self.retries = 0
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._stats_lock = threading.Lock()
+
+    def embed(self, text):
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts):
+        """Embeddings of `texts`, in input order."""
+        texts = list(texts)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1:
+            results = [self._call(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                results = list(executor.map(self._call, batches))
+        return [vector for batch in results for vector in batch]
+
+    def _call(self, batch):
+        for attempt in range(self.max_retries + 1):
+            with self._slots:
+                with self._stats_lock:
+                    self.requests += 1
+                try:
+                    return self._embed_batch(batch)
+                except Exception as e:
+                    if attempt == self.max_retries or not self._is_retryable(e):
+                        raise
+                    error = e
+            # Sleep outside the slot: another caller can use it meanwhile.
+            delay = min(self.max_backoff_seconds, _retry_after(error) or self.backoff_seconds * 2 ** attempt)
+            delay *= 1 + random.random() * 0.25
+            with self._stats_lock:
+                self.retries += 1
+            print(f"Embedding request failed ({type(error).__name__}), retrying in {delay:.1f}s "
+                  f"(attempt {attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+
+    def _embed_batch(self, texts):
+        raise NotImplementedError
+
+    def _is_retryable(self, error):
+        return False
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """`get_client` returns an OpenAI client; it is only called when a batch is sent, so
+    main.py keeps creating its client lazily."""
+
+    def __init__(self, get_client=None, model=EMBEDDING_MODEL, rate_limiter=None, **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+        self.rate_limiter = rate_limiter or RateLimiter(EMBEDDING_RPM, EMBEDDING_TPM)
+        self._get_client = get_client or _default_openai_client
+
+    def _embed_batch(self, texts):
+        self.rate_limiter.acquire(estimate_tokens(texts))
+        response = self._get_client().embeddings.create(input=texts, model=self.model)
+        # Results come back tagged with their input index.
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def _is_retryable(self, error):
+        import openai
+
+        return isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                                  openai.InternalServerError))
+
+
+def _retry_after(error):
+    """Seconds from the Retry-After header of a 429, if the server sent one."""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+
+def _default_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                # The provider retries itself; the client's own retries would nest inside it.
+                _openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+    return _openai_client
+
+
+class HashEmbeddingProvider(EmbeddingProvider):
+    """Same text, same unit vector; different texts are unrelated. Needs no network."""
+
+    def __init__(self, dim=HASH_EMBEDDING_DIM, **kwargs):
+        super().__init__(**kwargs)
+        self.dim = dim
+        self.model = f"hash-{dim}"
+
+    def _embed_batch(self, texts):
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32)
+            vectors.append((vector / np.linalg.norm(vector)).tolist())
+        return vectors
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """sentence-transformers model run in-process; loaded on the first batch."""
+
+    def __init__(self, model=LOCAL_EMBEDDING_MODEL, **kwargs):
+        # One encode call at a time; the model already uses every core.
+        kwargs.setdefault("max_concurrency", 1)
+        super().__init__(**kwargs)
+        self.model = model
+        self._encoder = None
+        self._encoder_lock = threading.Lock()
+
+    def _embed_batch(self, texts):
+        with self._encoder_lock:
+            if self._encoder is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError as e:
+                    raise ImportError("EMBEDDING_BACKEND=local needs `pip install sentence-transformers`.") from e
+                self._encoder = SentenceTransformer(self.model, device="cpu")
+        return self._encoder.encode(texts, batch_size=len(texts), normalize_embeddings=True).tolist()
+
+
+def create_embedding_provider(backend=EMBEDDING_BACKEND, get_client=None, serving_concurrency=None):
+    """Batch profile for the ingest scripts, or with `serving_concurrency` the serving
+    profile: that many requests in flight and SERVING_MAX_RETRIES retries of at most
+    SERVING_MAX_BACKOFF_SECONDS each, so a 429 costs a query seconds, not minutes."""
+    options = {}
+    if serving_concurrency is not None:
+        options = {
+            "max_concurrency": serving_concurrency,
+            "max_retries": SERVING_MAX_RETRIES,
+            "backoff_seconds": SERVING_BACKOFF_SECONDS,
+            "max_backoff_seconds": SERVING_MAX_BACKOFF_SECONDS,
+        }
+    if backend == "openai":
+        return OpenAIEmbeddingProvider(get_client, **options)
+    if backend == "hash":
+        return HashEmbeddingProvider(**options)
+    if backend == "local":
+        # The model already uses every core; keep its single encode slot.
+        options.pop("max_concurrency", None)
+        return LocalEmbeddingProvider(**options)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}' (expected openai, hash or local).")
@@ -0,0 +1,155 @@
+# index_snapshot.py
+#
+# Prebuilt, versioned copy of the serving index, written offline by
+# backend/build_index.py --snapshot and memory-mapped by the function at startup.
+#
+#   index/CURRENT                         name of the active snapshot directory
+#   index/snapshots/<name>/manifest.json  corpus version, model, dim, folder row ranges
+#   index/snapshots/<name>/vectors.npy    (rows, dim) float32, L2-normalized, grouped by folder
+#   index/snapshots/<name>/ids.npy        fixed-width unicode meme ids, one per row
+#   index/snapshots/<name>/descriptions.bin + description_offsets.npy
+#                                         UTF-8 descriptions, decoded only when a row is read
+#   index/snapshots/<name>/lexical/<folder>.npz
+#                                         precomputed BM25 inverted index (lexical_index.py)
+#
+# Everything is opened with mmap_mode="r", so startup cost does not grow with the corpus.
+
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from ann_index import INDEX_DIR
+from lexical_index import LexicalIndex
+
+SNAPSHOTS_DIR = INDEX_DIR / "snapshots"
+CURRENT_FILE = INDEX_DIR / "CURRENT"
+
+
+class Descriptions:
+    """Read-only sequence of descriptions backed by a memory-mapped UTF-8 blob."""
+
+    def __init__(self, blob, offsets, start=0, stop=None):
+        self._blob = blob
+        self._offsets = offsets
+        self._start = start
+        self._stop = len(offsets) - 1 if stop is None else stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            start, stop, step = row.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return Descriptions(self._blob, self._offsets, self._start + start, self._start + stop)
+        row = int(row)
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        begin, end = self._offsets[self._start + row], self._offsets[self._start + row + 1]
+        return bytes(self._blob[begin:end]).decode("utf-8")
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+
+class IndexSnapshot:
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / "manifest.json", "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest.get("version")
+        self.folders = {folder_id: tuple(bounds) for folder_id, bounds in self.manifest["folders"].items()}
+
+        self.vectors = np.load(self.path / "vectors.npy", mmap_mode="r")
+        self.ids = np.load(self.path / "ids.npy", mmap_mode="r")
+        offsets = np.load(self.path / "description_offsets.npy", mmap_mode="r")
+        if offsets[-1] > 0:
+            blob = np.memmap(self.path / "descriptions.bin", dtype=np.uint8, mode="r")
+        else:
+            blob = np.empty(0, dtype=np.uint8)
+        self.descriptions = Descriptions(blob, offsets)
+
+    def __contains__(self, folder_id):
+        return folder_id in self.folders
+
+    def folder_rows(self, folder_id):
+        """(ids, descriptions, vectors) views of one folder; nothing is copied."""
+        start, stop = self.folders[folder_id]
+        return self.ids[start:stop], self.descriptions[start:stop], self.vectors[start:stop]
+
+    def lexical_index(self, folder_id):
+        path = self.path / "lexical" / f"{folder_id}.npz"
+        return LexicalIndex.load(path) if path.exists() else None
+
+
+def write_snapshot(shards, version, model, name=None):
+    """Writes the shards as a new snapshot and points CURRENT at it. Returns its path."""
+    name = name or f"v{version}-{time.strftime('%Y%m%d%H%M%S')}"
+    path = SNAPSHOTS_DIR / name
+    path.mkdir(parents=True, exist_ok=True)
+
+    shards = [shard for shard in shards if len(shard)]
+    folders = {}
+    row = 0
+    for shard in shards:
+        folders[shard.folder_id] = [row, row + len(shard)]
+        row += len(shard)
+
+    dim = shards[0].matrix.shape[1] if shards else 0
+    vectors = np.lib.format.open_memmap(path / "vectors.npy", mode="w+", dtype=np.float32, shape=(row, dim))
+    for shard in shards:
+        start, stop = folders[shard.folder_id]
+        vectors[start:stop] = shard.matrix
+    vectors.flush()
+    del vectors
+
+    np.save(path / "ids.npy", np.asarray([meme_id for shard in shards for meme_id in shard.ids], dtype=str))
+
+    encoded = [description.encode("utf-8") for shard in shards for description in shard.descriptions]
+    np.save(path / "description_offsets.npy", np.concatenate([[0], np.cumsum([len(e) for e in encoded])]).astype(np.int64))
+    with open(path / "descriptions.bin", "wb") as f:
+        for e in encoded:
+            f.write(e)
+
+    for shard in shards:
+        LexicalIndex.build(shard.descriptions).save(path / "lexical" / f"{shard.folder_id}.npz")
+
+    with open(path / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump({
+            "version": version,
+            "model": model,
+            "dim": dim,
+            "rows": row,
+            "folders": folders,
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }, f, ensure_ascii=False, indent=2)
+
+    # Switch CURRENT atomically so a concurrent reader never sees a half-written name.
+    temp_current = CURRENT_FILE.with_suffix(".tmp")
+    temp_current.write_text(name, encoding="utf-8")
+    os.replace(temp_current, CURRENT_FILE)
+    return path
+
+
+def load_current_snapshot():
+    """Opens the snapshot named in index/CURRENT, or returns None if there is none."""
+    if not CURRENT_FILE.exists():
+        return None
+    path = SNAPSHOTS_DIR / CURRENT_FILE.read_text(encoding="utf-8").strip()
+    try:
+        started = time.perf_counter()
+        snapshot = IndexSnapshot(path)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"Mapped index snapshot '{path.name}' (version {snapshot.version}, "
+              f"{len(snapshot.ids)} memes) in {elapsed_ms:.1f} ms")
+        return snapshot
+    except Exception as e:
+        print(f"Could not open index snapshot '{path}': {e}")
+        return None
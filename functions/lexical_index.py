@@ -0,0 +1,126 @@
+# lexical_index.py
+#
+# Character n-gram BM25 index over the on-image text (文字) and use cases (使用案例).
+# A meme's Firestore `description` is the ingest text "文字\n使用案例...", so its first
+# line is the exact quote. Quote n-grams are weighted QUOTE_BOOST times higher, and
+# the normalized quote is kept per row so exact-quote queries can be recognized.
+#
+# The inverted index is stored as CSR arrays (term -> rows, term frequencies). It is
+# precomputed into the index snapshot by backend/build_index.py --snapshot, or built
+# on first use for folders loaded from Firestore.
+
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+QUOTE_BOOST = 2.0
+# Queries shorter than this (after normalization) are never treated as exact quotes.
+QUOTE_MIN_CHARS = 3
+
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_text(text):
+    """NFKC, lower case, punctuation and whitespace removed."""
+    return _NON_WORD.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def char_ngrams(text):
+    """Unigrams and bigrams of the normalized text."""
+    text = normalize_text(text)
+    return list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+
+
+class LexicalIndex:
+    def __init__(self, vocab, offsets, rows, tfs, doc_len, quotes):
+        self.vocab = list(vocab)
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.quotes = list(quotes)
+        self.avg_doc_len = float(doc_len.mean()) if len(doc_len) else 0.0
+        self._term_ids = {term: i for i, term in enumerate(self.vocab)}
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    @classmethod
+    def build(cls, descriptions):
+        postings = defaultdict(list)
+        doc_len = np.zeros(len(descriptions), dtype=np.float32)
+        quotes = []
+        for row, description in enumerate(descriptions):
+            quote, _, use_cases = description.partition("\n")
+            quotes.append(normalize_text(quote))
+
+            counts = Counter()
+            for term, tf in Counter(char_ngrams(quote)).items():
+                counts[term] += tf * QUOTE_BOOST
+            counts.update(char_ngrams(use_cases))
+
+            doc_len[row] = sum(counts.values())
+            for term, tf in counts.items():
+                postings[term].append((row, tf))
+
+        vocab = sorted(postings)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in vocab])
+        rows = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.float32)
+        for i, term in enumerate(vocab):
+            entries = postings[term]
+            rows[offsets[i]:offsets[i + 1]] = [row for row, _ in entries]
+            tfs[offsets[i]:offsets[i + 1]] = [tf for _, tf in entries]
+        return cls(vocab, offsets, rows, tfs, doc_len, quotes)
+
+    def scores(self, query):
+        """BM25 score of every row; rows sharing no n-gram with the query score 0."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        num_docs = len(self)
+        for term in set(char_ngrams(query)):
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                continue
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = self.rows[start:stop]
+            tf = self.tfs[start:stop]
+            df = stop - start
+            idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+            length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[rows] / self.avg_doc_len)
+            scores[rows] += idf * tf * (BM25_K1 + 1) / (tf + length_norm)
+        return scores
+
+    def is_quote_match(self, query, row):
+        """True when the query is (part of) the row's on-image text, or quotes all of it."""
+        query = normalize_text(query)
+        quote = self.quotes[row]
+        if len(query) < QUOTE_MIN_CHARS or not quote:
+            return False
+        return query in quote or (len(quote) >= QUOTE_MIN_CHARS and quote in query)
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                vocab=np.asarray(self.vocab, dtype=str),
+                offsets=self.offsets,
+                rows=self.rows,
+                tfs=self.tfs,
+                doc_len=self.doc_len,
+                quotes=np.asarray(self.quotes, dtype=str),
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["vocab"].tolist(), data["offsets"], data["rows"], data["tfs"],
+                       data["doc_len"], data["quotes"].tolist())
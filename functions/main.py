@@ -1,82 +1,355 @@
 # main.py
 
-import os
-import json
-from dotenv import load_dotenv
-import numpy as np
-from openai import OpenAI
-import firebase_admin
-from firebase_admin import credentials, firestore
-from firebase_functions import https_fn
-
-# ... (your other initializations) ...
-if not firebase_admin._apps:
-    cred = credentials.Certificate('service-account-key.json')
-    firebase_admin.initialize_app(cred)
-db = firestore.client()
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-
-def cosine_sim(a, b):
-    a = np.array(a)
-    b = np.array(b)
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-
-# <<< START OF CORRECTED FUNCTION >>>
-@https_fn.on_request()
+import startup_timing
+
+with startup_timing.span("import_stdlib"):
+    import os
+    import gzip
+    import json
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+with startup_timing.span("import_firebase_functions"):
+    from dotenv import load_dotenv
+    from firebase_functions import https_fn
+
+with startup_timing.span("import_index"):
+    from embedding_cache import create_embedding_cache, normalize_query
+    from embedding_provider import create_embedding_provider
+    from index_snapshot import load_current_snapshot
+    from meme_index import RESULT_FIELDS, MemeIndex
+    from projection import load_projection
+    from ttl_cache import TTLCache
+    import request_timing
+
+DEFAULT_TOP_K = 25
+# Upper bound on top_k, so one request cannot ask for a result list (or MMR pool) the
+# size of the corpus.
+MAX_TOP_K = int(os.environ.get("MAX_TOP_K", "100"))
+DEFAULT_FOLDERS = ['mygo', 'popular']
+# Folders one request may enable (the old Firestore 'in' query limit).
+MAX_ENABLED_FOLDERS = 30
+# "vector" (embedding only) or "hybrid" (BM25 over the meme text fused with vectors).
+DEFAULT_SEARCH_MODE = os.environ.get("SEARCH_MODE", "vector")
+MAX_BATCH_QUERIES = 32
+# Responses smaller than this are not worth gzipping.
+GZIP_MIN_BYTES = 1024
+# Encoded responses of recent searches (plain and gzipped bytes), keyed by query, options
+# and corpus version.
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get("RESULT_CACHE_TTL_SECONDS", "3600"))
+# Requests one instance serves at once (needs a full vCPU), and the threads that run the
+# corpus version check, folder loads and embedding-cache writes next to the request.
+REQUEST_CONCURRENCY = int(os.environ.get("REQUEST_CONCURRENCY", "16"))
+REQUEST_POOL_WORKERS = int(os.environ.get("REQUEST_POOL_WORKERS", "8"))
+
+# Firestore and OpenAI clients are created on first use: their imports dominate a cold
+# start, and OPTIONS requests or embedding-cache hits never need the OpenAI client.
+_db = None
+_openai_client = None
+_client_lock = threading.Lock()
+
+
+def get_db():
+    global _db
+    if _db is None:
+        with _client_lock:
+            if _db is None:
+                with startup_timing.span("init_firestore"):
+                    import firebase_admin
+                    from firebase_admin import credentials, firestore
+                    if not firebase_admin._apps:
+                        cred = credentials.Certificate('service-account-key.json')
+                        firebase_admin.initialize_app(cred)
+                    _db = firestore.client()
+                startup_timing.emit("init_firestore")
+    return _db
+
+
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        with _client_lock:
+            if _openai_client is None:
+                with startup_timing.span("init_openai"):
+                    from openai import OpenAI
+                    # embedding_provider retries (briefly) itself; no nested client retries.
+                    _openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+                startup_timing.emit("init_openai")
+    return _openai_client
+
+
+# Embeddings stay in memory between requests; see meme_index.py for refresh rules.
+# A prebuilt snapshot, if deployed, is memory-mapped here so the first search skips Firestore.
+# A deployed projection (index/projection.npz) lets large folders be coarse-scored in fewer dims.
+with startup_timing.span("init_index"):
+    request_pool = ThreadPoolExecutor(max_workers=REQUEST_POOL_WORKERS, thread_name_prefix="meme-search")
+    # Corpus version checks after the first one run on request_pool, off the request path.
+    meme_index = MemeIndex(get_db, snapshot=load_current_snapshot(), projection=load_projection(),
+                           executor=request_pool)
+    # Persistent-tier writes run on request_pool, off the embedding-miss path.
+    embedding_cache = create_embedding_cache(get_db, executor=request_pool)
+    # EMBEDDING_BACKEND picks OpenAI (default), the offline hash embedder or a local model.
+    # Serving profile: a slot per concurrent request and only short retries.
+    embedding_provider = create_embedding_provider(get_client=get_openai_client,
+                                                   serving_concurrency=REQUEST_CONCURRENCY)
+    result_cache = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL_SECONDS)
+    _result_cache_version = None
+startup_timing.emit("module_import")
+
+
+def cors_preflight_response():
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "POST, GET, OPTIONS",
+        "Access-Control-Allow-Headers": "Content-Type",
+        "Access-Control-Max-Age": "3600",
+    }
+    return https_fn.Response("", headers=headers, status=204)
+
+
+def resolve_enabled_folders(body):
+    """Folder ids to search; raises ValueError unless "enabled_folders" is a short list of ids."""
+    enabled_folders = body.get("enabled_folders")
+    if not enabled_folders:
+        return DEFAULT_FOLDERS
+    if (not isinstance(enabled_folders, list) or len(enabled_folders) > MAX_ENABLED_FOLDERS
+            or not all(isinstance(folder_id, str) and folder_id for folder_id in enabled_folders)):
+        raise ValueError(f"'enabled_folders' must be a list of at most {MAX_ENABLED_FOLDERS} folder ids.")
+    if 'all' in enabled_folders:
+        return DEFAULT_FOLDERS
+    return enabled_folders
+
+
+def parse_top_k(value):
+    """top_k as a positive int of at most MAX_TOP_K; raises ValueError otherwise."""
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= MAX_TOP_K:
+        raise ValueError(f"'top_k' must be an integer between 1 and {MAX_TOP_K}.")
+    return value
+
+
+def parse_fields(body):
+    """Requested result fields; None if the request names an unknown field."""
+    fields = body.get("fields")
+    if not fields:
+        return RESULT_FIELDS
+    if any(field not in RESULT_FIELDS for field in fields):
+        return None
+    return tuple(field for field in RESULT_FIELDS if field in fields)
+
+
+def parse_mmr_lambda(body):
+    """Optional MMR trade-off in [0, 1]; raises ValueError when out of range."""
+    mmr_lambda = body.get("mmr_lambda")
+    if mmr_lambda is None:
+        return None
+    mmr_lambda = float(mmr_lambda)
+    if not 0.0 <= mmr_lambda <= 1.0:
+        raise ValueError("'mmr_lambda' must be between 0 and 1.")
+    return mmr_lambda
+
+
+def to_columns(hits, fields):
+    # Compact format: parallel arrays instead of one object per result.
+    return {field: [hit[field] for hit in hits] for field in fields}
+
+
+def result_cache_key(query, enabled_folders, top_k, fields, mmr_lambda, mode, result_format):
+    """Key for result_cache. Entries of an older corpus version are dropped as soon as a
+    request sees the version bump (at most MEME_INDEX_VERSION_CHECK_SECONDS after upload)."""
+    global _result_cache_version
+    version = meme_index.version()
+    if version != _result_cache_version:
+        result_cache.clear()
+        _result_cache_version = version
+    return (normalize_query(query), tuple(sorted(set(enabled_folders))), top_k, fields, mmr_lambda,
+            mode, result_format, version)
+
+
+def encode_json(payload):
+    with request_timing.span("serialize"):
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(req, payload, headers):
+    return encoded_json_response(req, encode_json(payload), headers)
+
+
+def encoded_json_response(req, data, headers, gzipped=None):
+    """Sends `data`, gzipped when the client accepts it; `gzipped` skips the compression."""
+    with request_timing.span("serialize"):
+        headers["Vary"] = "Accept-Encoding"
+        if len(data) >= GZIP_MIN_BYTES and "gzip" in req.headers.get("Accept-Encoding", ""):
+            data = gzipped if gzipped is not None else gzip.compress(data, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+    return https_fn.Response(data, content_type="application/json; charset=utf-8", headers=headers)
+
+
+def cached_json_response(req, cache_key, data, headers):
+    """Caches both encodings of `data`, so a result cache hit never compresses again."""
+    with request_timing.span("serialize"):
+        gzipped = gzip.compress(data, compresslevel=5) if len(data) >= GZIP_MIN_BYTES else None
+    result_cache.put(cache_key, (data, gzipped))
+    return encoded_json_response(req, data, headers, gzipped)
+
+
+def ndjson_stream(query_embedding, enabled_folders, top_k, fields):
+    """One {"type": "partial"} line per folder as it is scored, then {"type": "final"}."""
+    try:
+        for folder_id, hits in meme_index.search_stream(query_embedding, enabled_folders, top_k, fields):
+            if folder_id is None:
+                message = {"type": "final", "results": hits}
+            else:
+                message = {"type": "partial", "folder": folder_id, "results": hits}
+            yield json.dumps(message, ensure_ascii=False, separators=(",", ":")) + "\n"
+    except Exception as e:
+        # The status line is already sent, so report the failure in-band.
+        print(f"An error occurred while streaming: {e}")
+        yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+
+
+@https_fn.on_request(concurrency=REQUEST_CONCURRENCY, cpu=1)
+@request_timing.timed
 def find_similar_memes_v2(req: https_fn.Request) -> https_fn.Response:
-    
-    # --- This CORS handling part is still correct and necessary ---
+    """One query against the in-memory index of the enabled folders.
+
+    Answers from the result cache when it can; otherwise embeds the query (through the
+    embedding cache) and searches, or with "mode": "hybrid" fuses BM25 with vector
+    search. "stream": true returns NDJSON partial results per folder instead; streaming
+    is vector search only, so it cannot be combined with "mmr_lambda", "mode": "hybrid"
+    or "format": "columns" (400). A SEARCH_MODE=hybrid default does not apply to streams.
+    """
     if req.method == "OPTIONS":
-        headers = {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST, GET, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type",
-            "Access-Control-Max-Age": "3600",
-        }
-        return https_fn.Response("", headers=headers, status=204)
+        return cors_preflight_response()
 
     headers = { "Access-Control-Allow-Origin": "*" }
 
-    # --- The main logic with the fix ---
     try:
-        # <<< THIS IS THE FIX >>>
-        # Use force=True to bypass strict header checking and ensure the body is parsed as JSON.
-        body = req.get_json(force=True) 
-        
+        # force=True parses the body as JSON even without a JSON Content-Type header.
+        body = req.get_json(force=True)
+
         query = body.get("query")
         if not query:
             return https_fn.Response("Missing 'query' in request body.", status=400, headers=headers)
 
-        # ... The rest of your function logic is correct and does not need to change ...
-        top_k = body.get("top_k", 25)
-        enabled_folders = body.get("enabled_folders")
-        
-        if not enabled_folders or 'all' in enabled_folders:
-            enabled_folders = ['mygo', 'popular']
-
-        response = client.embeddings.create(input=query, model="text-embedding-ada-002")
-        query_embedding = response.data[0].embedding
-
-        memes_query = db.collection_group("items").where('folder_id', 'in', enabled_folders)
-
-        sims = []
-        for meme_doc in memes_query.stream():
-            meme_data = meme_doc.to_dict()
-            if "embedding" in meme_data and "id" in meme_data:
-                similarity = cosine_sim(query_embedding, meme_data["embedding"])
-                folder_name = meme_doc.reference.parent.parent.id
-                sims.append({
-                    "id": meme_data["id"],
-                    "description": meme_data.get("description", ""),
-                    "score": similarity,
-                    "folderName": folder_name,
-                })
-
-        top_results = sorted(sims, key=lambda x: x["score"], reverse=True)[:top_k]
-        
-        return https_fn.Response(json.dumps(top_results), mimetype="application/json", headers=headers)
+        fields = parse_fields(body)
+        if fields is None:
+            return https_fn.Response(f"'fields' may only contain {', '.join(RESULT_FIELDS)}.", status=400, headers=headers)
+        try:
+            enabled_folders = resolve_enabled_folders(body)
+            top_k = parse_top_k(body.get("top_k", DEFAULT_TOP_K))
+            mmr_lambda = parse_mmr_lambda(body)
+        except ValueError as e:
+            return https_fn.Response(str(e), status=400, headers=headers)
+
+        mode = body.get("mode", DEFAULT_SEARCH_MODE)
+        result_format = body.get("format")
+        if body.get("stream") and (mmr_lambda is not None or body.get("mode") == "hybrid" or result_format == "columns"):
+            return https_fn.Response("'stream' cannot be combined with 'mmr_lambda', 'mode': 'hybrid' or 'format': 'columns'.",
+                                     status=400, headers=headers)
+        cache_key = None
+        if not body.get("stream"):
+            cache_key = result_cache_key(query, enabled_folders, top_k, fields, mmr_lambda, mode, result_format)
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                headers["X-Result-Cache"] = "hit"
+                data, gzipped = cached
+                return encoded_json_response(req, data, headers, gzipped)
+            headers["X-Result-Cache"] = "miss"
+
+        if mode == "hybrid" and not body.get("stream"):
+            def embed():
+                with request_timing.span("embed"):
+                    query_embedding, cache_source = embedding_cache.get_or_embed(query, embedding_provider.model, embedding_provider.embed)
+                headers["X-Embedding-Cache"] = cache_source
+                return query_embedding
+
+            top_results, embedded = meme_index.search_hybrid(query, embed, enabled_folders, top_k, fields, mmr_lambda)
+            if not embedded:
+                headers["X-Embedding-Cache"] = "skipped"
+            if result_format == "columns":
+                top_results = to_columns(top_results, fields)
+            data = encode_json(top_results)
+            return cached_json_response(req, cache_key, data, headers)
+
+        # Folder loads (if any) run on request_pool while this thread embeds the query.
+        meme_index.prefetch(sorted(set(enabled_folders)), request_pool)
+        with request_timing.span("embed"):
+            query_embedding, cache_source = embedding_cache.get_or_embed(query, embedding_provider.model, embedding_provider.embed)
+        headers["X-Embedding-Cache"] = cache_source
+
+        if body.get("stream"):
+            return https_fn.Response(ndjson_stream(query_embedding, enabled_folders, top_k, fields),
+                                     content_type="application/x-ndjson; charset=utf-8", headers=headers)
+
+        top_results = meme_index.search(query_embedding, enabled_folders, top_k, fields, mmr_lambda)
+        if result_format == "columns":
+            top_results = to_columns(top_results, fields)
+
+        data = encode_json(top_results)
+        return cached_json_response(req, cache_key, data, headers)
     
     except Exception as e:
         print(f"An error occurred: {e}")
         return https_fn.Response(f"Internal Server Error: {e}", status=500, headers=headers)
+
+
+
+@https_fn.on_request(concurrency=REQUEST_CONCURRENCY, cpu=1)
+@request_timing.timed
+def find_similar_memes_batch(req: https_fn.Request) -> https_fn.Response:
+    """Several intentions in one round trip.
+
+    Body: {"queries": ["...", {"query": "...", "top_k": 5}, ...], "top_k": 25, "enabled_folders": [...]}
+    plus the same optional "fields", "format" and "mmr_lambda" as find_similar_memes_v2.
+    Returns [{"query": "...", "results": [...]}, ...] in request order.
+    """
+    if req.method == "OPTIONS":
+        return cors_preflight_response()
+
+    headers = { "Access-Control-Allow-Origin": "*" }
+
+    try:
+        body = req.get_json(force=True)
+
+        default_top_k = body.get("top_k", DEFAULT_TOP_K)
+        queries = []
+        top_ks = []
+        for item in body.get("queries") or []:
+            if isinstance(item, dict):
+                queries.append(item.get("query"))
+                top_ks.append(item.get("top_k", default_top_k))
+            else:
+                queries.append(item)
+                top_ks.append(default_top_k)
+
+        if not queries or not all(isinstance(q, str) and q for q in queries):
+            return https_fn.Response("'queries' must be a non-empty list of query strings.", status=400, headers=headers)
+        if len(queries) > MAX_BATCH_QUERIES:
+            return https_fn.Response(f"At most {MAX_BATCH_QUERIES} queries per request.", status=400, headers=headers)
+
+        fields = parse_fields(body)
+        if fields is None:
+            return https_fn.Response(f"'fields' may only contain {', '.join(RESULT_FIELDS)}.", status=400, headers=headers)
+        try:
+            enabled_folders = resolve_enabled_folders(body)
+            top_ks = [parse_top_k(top_k) for top_k in top_ks]
+            mmr_lambda = parse_mmr_lambda(body)
+        except ValueError as e:
+            return https_fn.Response(str(e), status=400, headers=headers)
+
+        meme_index.prefetch(sorted(set(enabled_folders)), request_pool)
+        with request_timing.span("embed"):
+            embedded = embedding_cache.get_or_embed_many(queries, embedding_provider.model, embedding_provider.embed_many)
+        headers["X-Embedding-Cache"] = ",".join(source for _, source in embedded)
+
+        grouped = meme_index.search_many([vector for vector, _ in embedded], enabled_folders, top_ks, fields, mmr_lambda)
+        if body.get("format") == "columns":
+            grouped = [to_columns(hits, fields) for hits in grouped]
+        results = [{"query": query, "results": hits} for query, hits in zip(queries, grouped)]
+
+        return json_response(req, results, headers)
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return https_fn.Response(f"Internal Server Error: {e}", status=500, headers=headers)
@@ -0,0 +1,605 @@
+# meme_index.py
+#
+# In-memory embedding index used by find_similar_memes_v2.
+# Every folder (mygo, popular, spongebob, ...) is held as one contiguous float32
+# matrix plus parallel id/description tables. A folder comes from the prebuilt,
+# memory-mapped snapshot (index_snapshot.py) when that matches the corpus version, or
+# is read from Firestore once per instance otherwise, and is then reused until its TTL
+# expires or the corpus version (bumped by the ingest scripts after an upload) changes.
+
+import contextvars
+import os
+import threading
+import time
+
+import numpy as np
+
+from ann_index import load_ann_for
+from lexical_index import LexicalIndex
+from projection import PROJECTION_MIN_ROWS
+from quantization import INDEX_PRECISION, RERANK_CANDIDATES, coarse_scores, is_disk_backed, quantize, rerank_matrix
+from request_timing import span
+from ttl_cache import TTLCache
+
+# --- Configuration ---
+INDEX_TTL_SECONDS = float(os.environ.get("MEME_INDEX_TTL_SECONDS", "3600"))
+VERSION_CHECK_SECONDS = float(os.environ.get("MEME_INDEX_VERSION_CHECK_SECONDS", "60"))
+# Folder ids that turned out to have no memes (typos, unknown ids) are remembered in a
+# bounded LRU instead of next to the real shards, so arbitrary ids cannot grow the index.
+EMPTY_FOLDER_CACHE_SIZE = int(os.environ.get("MEME_INDEX_EMPTY_FOLDER_CACHE_SIZE", "256"))
+# Hybrid search: candidates taken from each ranking, and the reciprocal rank fusion constant.
+HYBRID_POOL = int(os.environ.get("HYBRID_POOL", "100"))
+RRF_K = 60
+# MMR diversification re-selects top_k out of this many times top_k candidates, but never
+# more than MMR_MAX_POOL: mmr_select holds a pool x pool similarity matrix.
+MMR_POOL_FACTOR = int(os.environ.get("MMR_POOL_FACTOR", "4"))
+MMR_MAX_POOL = int(os.environ.get("MMR_MAX_POOL", "400"))
+
+# Fields a search result can carry, in response order.
+RESULT_FIELDS = ("id", "description", "score", "folderName")
+
+# Document holding the corpus version counter, written by backend/populate_firestore.py.
+CORPUS_META_COLLECTION = "meta"
+CORPUS_META_DOCUMENT = "corpus"
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first, without sorting the whole array."""
+    if k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def mmr_pool_size(top_k):
+    """Candidates fetched for MMR to re-select top_k from."""
+    return max(top_k, min(top_k * MMR_POOL_FACTOR, MMR_MAX_POOL))
+
+
+def mmr_select(vectors, relevance, k, diversity_lambda):
+    """Maximal Marginal Relevance: picks k rows balancing relevance against redundancy.
+
+    Each step takes argmax of lambda * relevance - (1 - lambda) * max similarity to the
+    rows already picked, updating that running maximum with one vector operation.
+    Returns the picked row positions in selection order.
+    """
+    k = min(k, len(relevance))
+    if k <= 0:
+        return []
+    similarity = vectors @ vectors.T
+    max_similarity = np.zeros(len(relevance), dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    selected = []
+    for _ in range(k):
+        mmr = diversity_lambda * relevance - (1 - diversity_lambda) * max_similarity
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return selected
+
+
+class FolderShard:
+    """All embeddings of one folder as a single (n, dim) float32 matrix.
+
+    Rows are L2-normalized at load time so cosine similarity is a plain dot product.
+    Large folders may carry an IVF index (`ann`) that restricts scoring to a few clusters.
+    With a float16/int8 `precision`, candidates are scored from low-precision `codes` and
+    the shortlist is re-ranked against `matrix`: the snapshot's disk-backed rows, or a
+    float16 copy for rows read from Firestore (see quantization.py).
+    With a `projection` (projection.py), folders of at least `projection_min_rows` rows
+    are coarse-scored from `reduced` rows instead, which then replace the codes.
+    The BM25 `lexical` index comes from the snapshot or is built on first hybrid search.
+    """
+
+    def __init__(self, folder_id, ids, descriptions, matrix, version, ann=None, precision=INDEX_PRECISION,
+                 normalized=False, lexical=None, projection=None,
+                 projection_min_rows=PROJECTION_MIN_ROWS):
+        self.folder_id = folder_id
+        self.ids = ids
+        self.descriptions = descriptions
+        self.matrix = matrix if normalized or not len(matrix) else normalize_rows(matrix)
+        self.version = version
+        self.ann = ann
+        self.lexical = lexical
+
+        self.projection = projection
+        self.reduced = None
+        if projection is not None and len(matrix) >= projection_min_rows:
+            if projection.input_dim == self.matrix.shape[1]:
+                self.reduced = projection.project_rows(self.matrix)
+            else:
+                print(f"Projection expects {projection.input_dim} dims, folder '{folder_id}' has "
+                      f"{self.matrix.shape[1]}; scoring full vectors.")
+
+        self.codes = None
+        self.scales = None
+        if precision != "float32" and len(matrix):
+            if self.reduced is None:
+                self.codes, self.scales = quantize(self.matrix, precision)
+            self.matrix = rerank_matrix(self.matrix, self.codes, precision)
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def scores(self, query_matrix):
+        """Cosine scores of shape (num_queries, num_memes) for row-normalized queries."""
+        return query_matrix @ self.matrix.T
+
+    def top_k_many(self, query_matrix, top_ks):
+        """Returns one (rows, scores) pair per query, best first."""
+        if not len(self):
+            empty = (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32))
+            return [empty] * len(top_ks)
+
+        if self.ann is None and self.codes is None and self.reduced is None:
+            scores = self.scores(query_matrix)
+            results = []
+            for q, k in enumerate(top_ks):
+                rows = top_k_indices(scores[q], k)
+                results.append((rows, scores[q, rows]))
+            return results
+
+        # Without an ANN index every query's coarse pass covers all rows, so do it in one go.
+        has_coarse = self.codes is not None or self.reduced is not None
+        all_coarse = None
+        if self.ann is None:
+            all_coarse = self._coarse_scores(query_matrix)
+
+        results = []
+        for q, (query_vector, k) in enumerate(zip(query_matrix, top_ks)):
+            candidates = np.arange(len(self))
+            if self.ann is not None:
+                probed = self.ann.candidates(query_vector)
+                if len(probed) >= k:
+                    candidates = probed
+
+            if has_coarse:
+                if all_coarse is not None:
+                    coarse = all_coarse[q]
+                else:
+                    coarse = self._coarse_scores(query_vector[None, :], candidates)[0]
+                candidates = candidates[top_k_indices(coarse, max(k, RERANK_CANDIDATES))]
+
+            scores = self.matrix[candidates] @ query_vector
+            best = top_k_indices(scores, k)
+            results.append((candidates[best], scores[best]))
+        return results
+
+    def _coarse_scores(self, query_matrix, rows=None):
+        """Approximate scores from the reduced rows, or else from the quantized codes."""
+        if self.reduced is not None:
+            reduced = self.reduced if rows is None else self.reduced[rows]
+            return self.projection.project_queries(query_matrix) @ reduced.T
+        return coarse_scores(self.codes, self.scales, query_matrix, rows)
+
+    def resident_bytes(self):
+        """Bytes of scoring data held in memory. Rows memory-mapped from a file on disk
+        are not counted; a map of a tmpfs file is RAM like any other array."""
+        resident = 0 if is_disk_backed(self.matrix) else self.matrix.nbytes
+        for array in (self.codes, self.scales, self.reduced):
+            if array is not None and array is not self.matrix:
+                resident += array.nbytes
+        return resident
+
+    def hit(self, row, score, fields=RESULT_FIELDS):
+        # Only the requested fields are read, so descriptions are never decoded when unused.
+        hit = {}
+        if "id" in fields:
+            hit["id"] = self.ids[row]
+        if "description" in fields:
+            hit["description"] = self.descriptions[row]
+        if "score" in fields:
+            hit["score"] = float(score)
+        if "folderName" in fields:
+            hit["folderName"] = self.folder_id
+        return hit
+
+    def lexical_index(self):
+        # Built at most a few times under a race; every build is identical, so no lock.
+        if self.lexical is None:
+            self.lexical = LexicalIndex.build(self.descriptions)
+        return self.lexical
+
+
+def read_corpus_version(db):
+    snapshot = db.collection(CORPUS_META_COLLECTION).document(CORPUS_META_DOCUMENT).get()
+    if not snapshot.exists:
+        return None
+    return snapshot.to_dict().get("version")
+
+
+def load_folder_shard(db, folder_id, version=None, projection=None, precision=INDEX_PRECISION):
+    """Reads one folder from Firestore. The build scripts pass precision="float32" so the
+    rows they snapshot, cluster and compare against are never rounded."""
+    ids = []
+    descriptions = []
+    vectors = []
+
+    memes_query = (
+        db.collection_group("items")
+        .where("folder_id", "==", folder_id)
+        .select(["id", "description", "embedding"])
+    )
+    for meme_doc in memes_query.stream():
+        meme_data = meme_doc.to_dict()
+        if "embedding" in meme_data and "id" in meme_data:
+            ids.append(meme_data["id"])
+            descriptions.append(meme_data.get("description", ""))
+            vectors.append(meme_data["embedding"])
+
+    if vectors:
+        matrix = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+    else:
+        matrix = np.empty((0, 0), dtype=np.float32)
+    return FolderShard(folder_id, ids, descriptions, matrix, version, ann=load_ann_for(folder_id, ids),
+                       precision=precision, projection=projection)
+
+
+class MemeIndex:
+    """Per-instance cache of FolderShards with TTL and corpus-version invalidation.
+
+    `get_db` is a zero-argument callable returning the Firestore client, so the client is
+    only created once a folder or the corpus version actually has to be read. With an
+    `executor`, searches only wait for the very first corpus version check; later checks
+    run there in the background, one at a time.
+    """
+
+    def __init__(self, get_db, ttl_seconds=INDEX_TTL_SECONDS, version_check_seconds=VERSION_CHECK_SECONDS,
+                 snapshot=None, projection=None, executor=None):
+        self._get_db = get_db
+        self._executor = executor
+        self._snapshot = snapshot
+        self._projection = projection
+        self.ttl_seconds = ttl_seconds
+        self.version_check_seconds = version_check_seconds
+
+        self._shards = {}
+        self._empty = TTLCache(EMPTY_FOLDER_CACHE_SIZE, ttl_seconds)
+        self._lock = threading.Lock()
+        self._folder_locks = {}
+
+        self._version = None
+        self._version_checked_at = None
+        self._first_check_lock = threading.Lock()
+        self._refresh = None
+
+    def shards(self, folder_ids):
+        version = self.version()
+        return [self._shard(folder_id, version) for folder_id in folder_ids]
+
+    def prefetch(self, folder_ids, executor):
+        """Checks the corpus version and starts loading every missing or stale folder on
+        `executor`, each folder in its own task, without waiting for any of it.
+
+        A search() issued meanwhile finds the shards loaded, or waits on the folder lock
+        of a load still in flight. Returns the future of the loads' scheduling.
+        """
+        def refresh():
+            version = self.version()
+            for folder_id in folder_ids:
+                if not self._is_loaded(folder_id, version):
+                    executor.submit(contextvars.copy_context().run, self._shard, folder_id, version)
+
+        return executor.submit(contextvars.copy_context().run, refresh)
+
+    def scoring_shards(self, folder_ids):
+        """Non-empty shards of the enabled folders; no other folder is touched.
+
+        Each shard is scored on its own and the per-shard winners are merged, which costs
+        the same FLOPs as one product over a concatenation without copying any rows.
+        """
+        return [shard for shard in self.shards(sorted(set(folder_ids))) if len(shard)]
+
+    def search(self, query_embedding, folder_ids, top_k, fields=RESULT_FIELDS, mmr_lambda=None):
+        """Top-k cosine matches across the given folders, as result dicts sorted by score."""
+        return self.search_many([query_embedding], folder_ids, [top_k], fields, mmr_lambda)[0]
+
+    def search_many(self, query_embeddings, folder_ids, top_ks, fields=RESULT_FIELDS, mmr_lambda=None):
+        """Scores all queries against each folder with one matrix-matrix product
+        (or through the folder's IVF index when it has one).
+
+        Returns one result list per query, each cut to that query's own top_k. With
+        `mmr_lambda` set, each list is re-selected by MMR from mmr_pool_size(top_k)
+        candidates (1.0 = pure relevance, lower = more diverse).
+        """
+        if not len(query_embeddings):
+            return []
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        fetch_ks = top_ks if mmr_lambda is None else [mmr_pool_size(top_k) for top_k in top_ks]
+        shards = self.scoring_shards(folder_ids)
+        with span("score"):
+            per_shard = [(shard, shard.top_k_many(queries, fetch_ks)) for shard in shards]
+
+        results = []
+        with span("merge"):
+            for q, (top_k, fetch_k) in enumerate(zip(top_ks, fetch_ks)):
+                candidates = [(shard, *shard_results[q]) for shard, shard_results in per_shard]
+                if mmr_lambda is None:
+                    results.append(self._merge(candidates, top_k, fields))
+                else:
+                    ranked = self._diversify(self._merge_ranked(candidates, fetch_k), top_k, mmr_lambda)
+                    results.append([shard.hit(row, score, fields) for shard, row, score in ranked])
+        return results
+
+    def search_hybrid(self, query_text, embed, folder_ids, top_k, fields=RESULT_FIELDS, mmr_lambda=None):
+        """BM25 over 文字/使用案例 fused with vector search by reciprocal rank fusion.
+
+        If the query is an exact on-image quote of some memes, those come first and the
+        rest of the BM25 ranking fills up to top_k; `embed` is never called. Otherwise
+        `embed()` must return the query embedding. With `mmr_lambda` set, the final list
+        is re-selected by MMR as in search_many. Returns (hits, embedded); `score` holds
+        the fused RRF score, or the BM25 score for exact-quote answers.
+        """
+        fetch_k = top_k if mmr_lambda is None else mmr_pool_size(top_k)
+        pool = max(fetch_k, HYBRID_POOL)
+        shards = self.scoring_shards(folder_ids)
+
+        lexical = []
+        exact = []
+        with span("lexical"):
+            for shard in shards:
+                index = shard.lexical_index()
+                scores = index.scores(query_text)
+                rows = top_k_indices(scores, pool)
+                rows = rows[scores[rows] > 0]
+                lexical.append((shard, rows, scores[rows]))
+                exact.extend((shard, row, scores[row]) for row in rows if index.is_quote_match(query_text, row))
+
+        if exact:
+            exact.sort(key=lambda candidate: -candidate[2])
+            quoted = {(shard.folder_id, row) for shard, row, _ in exact}
+            rest = [candidate for candidate in self._merge_ranked(lexical, pool)
+                    if (candidate[0].folder_id, candidate[1]) not in quoted]
+            return self._hybrid_hits((exact + rest)[:fetch_k], top_k, fields, mmr_lambda), False
+
+        query = normalize_rows(np.asarray([embed()], dtype=np.float32))
+        with span("score"):
+            vector = [(shard, *shard.top_k_many(query, [pool])[0]) for shard in shards]
+
+        with span("merge"):
+            fused = {}
+            for ranked in (self._merge_ranked(vector, pool), self._merge_ranked(lexical, pool)):
+                for rank, (shard, row, _) in enumerate(ranked):
+                    key = (shard.folder_id, shard.ids[row])
+                    entry = fused.setdefault(key, [0.0, shard, row])
+                    entry[0] += 1.0 / (RRF_K + rank + 1)
+            best = sorted(fused.values(), key=lambda entry: -entry[0])[:fetch_k]
+            ranked = [(shard, row, score) for score, shard, row in best]
+            return self._hybrid_hits(ranked, top_k, fields, mmr_lambda), True
+
+    def _hybrid_hits(self, ranked, top_k, fields, mmr_lambda):
+        if mmr_lambda is not None and ranked:
+            # RRF and BM25 scores are not on the cosine scale MMR trades them against,
+            # so relevance is rescaled to [0, 1] by the best score first.
+            ranked = self._diversify(ranked, top_k, mmr_lambda, scale=max(score for _, _, score in ranked))
+        return [shard.hit(row, score, fields) for shard, row, score in ranked[:top_k]]
+
+    def search_stream(self, query_embedding, folder_ids, top_k, fields=RESULT_FIELDS):
+        """Yields (folder_id, hits) as soon as each folder is loaded and scored, then
+        (None, hits) with the merged top_k over all folders.
+
+        Folders that are already in memory are scored first so their partial results are
+        not held back by a folder that still has to be loaded.
+        """
+        query = normalize_rows(np.asarray([query_embedding], dtype=np.float32))
+        version = self.version()
+        folder_ids = sorted(set(folder_ids), key=lambda folder_id: not self._is_loaded(folder_id, version))
+
+        candidates = []
+        for folder_id in folder_ids:
+            shard = self._shard(folder_id, version)
+            if not len(shard):
+                continue
+            rows, scores = shard.top_k_many(query, [top_k])[0]
+            candidates.append((shard, rows, scores))
+            yield folder_id, self._merge([(shard, rows, scores)], top_k, fields)
+        yield None, self._merge(candidates, top_k, fields)
+
+    @staticmethod
+    def _merge_ranked(candidates, top_k):
+        """Merges per-shard (shard, rows, scores) winners into the best top_k (shard, row, score)."""
+        if not candidates:
+            return []
+        shard_of = np.concatenate([np.full(len(rows), i) for i, (_, rows, _) in enumerate(candidates)])
+        rows = np.concatenate([rows for _, rows, _ in candidates])
+        scores = np.concatenate([scores for _, _, scores in candidates])
+        best = top_k_indices(scores, top_k)
+        return [(candidates[shard_of[i]][0], rows[i], scores[i]) for i in best]
+
+    @staticmethod
+    def _diversify(ranked, top_k, mmr_lambda, scale=1.0):
+        if len(ranked) <= 1:
+            return ranked
+        vectors = np.stack([shard.matrix[row] for shard, row, _ in ranked]).astype(np.float32)
+        relevance = np.asarray([score / scale for _, _, score in ranked], dtype=np.float32)
+        return [ranked[i] for i in mmr_select(vectors, relevance, top_k, mmr_lambda)]
+
+    @classmethod
+    def _merge(cls, candidates, top_k, fields):
+        # Merge the per-folder winners; only the final top_k become dicts.
+        return [shard.hit(row, score, fields) for shard, row, score in cls._merge_ranked(candidates, top_k)]
+
+    def version(self):
+        """Corpus version for a search, reading Firestore at most once per due check.
+
+        The first check blocks (concurrent callers wait for the same read). After that a
+        due check is handed to `executor` and the last known version is returned at once;
+        later requests see the new one. Without an executor this is current_version().
+        """
+        if self._executor is None:
+            return self.current_version()
+        if self._version_checked_at is None:
+            with self._first_check_lock:
+                # current_version() returns the cached value if another caller just read it.
+                return self.current_version()
+        if self.version_check_due():
+            with self._lock:
+                if self._refresh is None or self._refresh.done():
+                    self._refresh = self._executor.submit(self.current_version)
+        return self._version
+
+    def version_check_due(self):
+        """True when the next current_version() call would read Firestore."""
+        with self._lock:
+            return (self._version_checked_at is None
+                    or time.monotonic() - self._version_checked_at >= self.version_check_seconds)
+
+    def known_version(self):
+        """Last corpus version read, without checking Firestore."""
+        return self._version
+
+    def current_version(self):
+        now = time.monotonic()
+        with self._lock:
+            if (self._version_checked_at is not None
+                    and now - self._version_checked_at < self.version_check_seconds):
+                return self._version
+
+        try:
+            with span("version"):
+                version = read_corpus_version(self._get_db())
+        except Exception as e:
+            # Keep serving the shards we have; the next request will try again.
+            print(f"Could not read corpus version: {e}")
+            return self._version
+
+        with self._lock:
+            self._version = version
+            self._version_checked_at = now
+        return version
+
+    def invalidate(self, folder_id=None):
+        with self._lock:
+            if folder_id is None:
+                self._shards.clear()
+            else:
+                self._shards.pop(folder_id, None)
+        self._empty.clear()
+
+    def _cached(self, folder_id):
+        shard = self._shards.get(folder_id)
+        return shard if shard is not None else self._empty.get(folder_id)
+
+    def _is_loaded(self, folder_id, version):
+        shard = self._cached(folder_id)
+        return shard is not None and not self._is_stale(shard, version)
+
+    def _is_stale(self, shard, version):
+        if time.monotonic() - shard.loaded_at > self.ttl_seconds:
+            return True
+        return version is not None and shard.version != version
+
+    def _folder_lock(self, folder_id):
+        with self._lock:
+            return self._folder_locks.setdefault(folder_id, threading.Lock())
+
+    def _load(self, folder_id, version):
+        snapshot = self._snapshot
+        if (snapshot is not None and folder_id in snapshot
+                and (version is None or snapshot.version == version)):
+            ids, descriptions, vectors = snapshot.folder_rows(folder_id)
+            shard = FolderShard(folder_id, ids, descriptions, vectors, snapshot.version,
+                                ann=load_ann_for(folder_id, ids), normalized=True,
+                                lexical=snapshot.lexical_index(folder_id), projection=self._projection)
+            return shard, "snapshot"
+        return load_folder_shard(self._get_db(), folder_id, version, self._projection), "Firestore"
+
+    def _shard(self, folder_id, version):
+        shard = self._cached(folder_id)
+        if shard is not None and not self._is_stale(shard, version):
+            return shard
+
+        # Only one thread reloads a folder; the others wait and reuse its result.
+        with self._folder_lock(folder_id):
+            shard = self._cached(folder_id)
+            if shard is None or self._is_stale(shard, version):
+                started = time.perf_counter()
+                with span("load"):
+                    shard, source = self._load(folder_id, version)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                print(f"Loaded folder '{folder_id}' from {source} ({len(shard)} memes, "
+                      f"version {shard.version}) in {elapsed_ms:.0f} ms")
+                if len(shard):
+                    with self._lock:
+                        self._shards[folder_id] = shard
+                else:
+                    self._empty.put(folder_id, shard)
+                    with self._lock:
+                        # A waiter still holding this lock is fine; a new one just reloads.
+                        self._folder_locks.pop(folder_id, None)
+        return shard
+
+
+def compare_precision(matrix, ids, precision, queries, k):
+    """Top-k drift of a quantized shard against exact float32 search over `queries`.
+
+    Returns the mean top-k overlap, the fraction of queries whose ranked ids are identical,
+    and the largest absolute score difference among the returned results. `matrix` is in
+    memory, so this measures the Firestore path (float16 re-rank rows), the less precise
+    of the two. Resident sizes are given for both that path and a deployed snapshot,
+    where only the codes stay in memory.
+    """
+    exact = FolderShard("exact", ids, [""] * len(ids), matrix, None, precision="float32")
+    quantized = FolderShard("quantized", ids, [""] * len(ids), matrix, None, precision=precision)
+    queries = normalize_rows(np.asarray(queries, dtype=np.float32))
+    top_ks = [k] * len(queries)
+
+    overlap = 0.0
+    identical = 0
+    max_score_delta = 0.0
+    for (exact_rows, exact_scores), (rows, scores) in zip(exact.top_k_many(queries, top_ks),
+                                                          quantized.top_k_many(queries, top_ks)):
+        overlap += len(np.intersect1d(exact_rows, rows)) / max(len(exact_rows), 1)
+        identical += int(np.array_equal(exact_rows, rows))
+        if len(rows) == len(exact_rows):
+            max_score_delta = max(max_score_delta, float(np.abs(exact_scores - scores).max(initial=0.0)))
+    return {
+        "precision": precision,
+        "overlap_at_k": overlap / len(queries),
+        "identical_ranking": identical / len(queries),
+        "max_score_delta": max_score_delta,
+        "resident_bytes": quantized.resident_bytes(),
+        "snapshot_resident_bytes": sum(array.nbytes for array in (quantized.codes, quantized.scales)
+                                       if array is not None),
+        "float32_bytes": exact.resident_bytes(),
+    }
+
+
+def compare_projection(matrix, ids, projection, queries, k):
+    """Recall@k of projected coarse scoring + full-vector re-rank against exact search,
+    with the mean per-query time of both paths."""
+    exact = FolderShard("exact", ids, [""] * len(ids), matrix, None, precision="float32")
+    projected = FolderShard("projected", ids, [""] * len(ids), matrix, None, precision="float32",
+                            projection=projection, projection_min_rows=0)
+    queries = normalize_rows(np.asarray(queries, dtype=np.float32))
+
+    found = 0
+    exact_seconds = 0.0
+    projected_seconds = 0.0
+    for query in queries:
+        started = time.perf_counter()
+        exact_rows, _ = exact.top_k_many(query[None, :], [k])[0]
+        exact_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        rows, _ = projected.top_k_many(query[None, :], [k])[0]
+        projected_seconds += time.perf_counter() - started
+        found += len(np.intersect1d(exact_rows, rows))
+    return {
+        "dim": projection.dim,
+        "recall_at_k": found / max(len(queries) * min(k, len(ids)), 1),
+        "exact_ms": exact_seconds * 1000 / len(queries),
+        "projected_ms": projected_seconds * 1000 / len(queries),
+        "shortlist": max(k, RERANK_CANDIDATES),
+    }
@@ -0,0 +1,99 @@
+# projection.py
+#
+# Reduced-dimension coarse scoring. backend/build_index.py --projection-dim learns one
+# linear map P (dim x 1536) for the whole corpus, either by PCA or by keeping the first
+# `dim` coordinates (only meaningful for models trained for truncation, such as the
+# text-embedding-3 family, not ada-002). It saves P to index/projection.npz.
+#
+# Rows are stored as P (x - mean) and queries are projected as P q, so that
+#     q . x  ~=  q . mean + (P q) . (P (x - mean))
+# The first term is the same for every row, so the reduced dot product ranks rows in
+# the order of their full cosine score, up to the variance PCA discarded. Folders of at
+# least PROJECTION_MIN_ROWS are scored this way, and the best RERANK_CANDIDATES rows
+# are re-scored with the full vectors.
+
+import os
+
+import numpy as np
+
+from ann_index import INDEX_DIR
+
+# --- Configuration ---
+PROJECTION_PATH = INDEX_DIR / "projection.npz"
+# "auto" uses index/projection.npz when it exists; "off" always scores full vectors.
+PROJECTION_MODE = os.environ.get("MEME_INDEX_PROJECTION", "auto")
+PROJECTION_MIN_ROWS = int(os.environ.get("MEME_INDEX_PROJECTION_MIN_ROWS", "10000"))
+# Rows sampled to estimate the covariance; PCA does not need the whole corpus.
+PCA_SAMPLE_ROWS = 100_000
+
+# Rows projected at a time, to bound temporary memory at load.
+PROJECT_CHUNK_ROWS = 8192
+
+
+class Projection:
+    def __init__(self, components, mean, method):
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.method = method
+
+    @property
+    def dim(self):
+        return self.components.shape[0]
+
+    @property
+    def input_dim(self):
+        return self.components.shape[1]
+
+    @classmethod
+    def fit_pca(cls, matrix, dim, seed=0):
+        """Top-`dim` principal directions of the (row-normalized) matrix."""
+        if len(matrix) > PCA_SAMPLE_ROWS:
+            rows = np.random.default_rng(seed).choice(len(matrix), PCA_SAMPLE_ROWS, replace=False)
+            matrix = matrix[np.sort(rows)]
+        matrix = np.asarray(matrix, dtype=np.float32)
+        mean = matrix.mean(axis=0)
+        centered = matrix - mean
+        covariance = (centered.T @ centered).astype(np.float64) / max(len(centered) - 1, 1)
+        # eigh returns ascending eigenvalues; keep the largest `dim`.
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:dim]
+        projection = cls(eigenvectors[:, order].T, mean, "pca")
+        projection.explained_variance = float(eigenvalues[order].sum() / max(eigenvalues.sum(), 1e-12))
+        return projection
+
+    @classmethod
+    def truncation(cls, input_dim, dim):
+        return cls(np.eye(input_dim, dtype=np.float32)[:dim], np.zeros(input_dim, dtype=np.float32), "truncate")
+
+    def project_rows(self, matrix):
+        reduced = np.empty((len(matrix), self.dim), dtype=np.float32)
+        for start in range(0, len(matrix), PROJECT_CHUNK_ROWS):
+            chunk = np.asarray(matrix[start:start + PROJECT_CHUNK_ROWS], dtype=np.float32)
+            reduced[start:start + len(chunk)] = (chunk - self.mean) @ self.components.T
+        return reduced
+
+    def project_queries(self, query_matrix):
+        return query_matrix @ self.components.T
+
+    def save(self, path=PROJECTION_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(f, components=self.components, mean=self.mean, method=np.asarray(self.method))
+
+    @classmethod
+    def load(cls, path=PROJECTION_PATH):
+        with np.load(path) as data:
+            return cls(data["components"], data["mean"], str(data["method"]))
+
+
+def load_projection():
+    """The deployed projection, or None when there is none or MEME_INDEX_PROJECTION=off."""
+    if PROJECTION_MODE == "off" or not PROJECTION_PATH.exists():
+        return None
+    try:
+        projection = Projection.load(PROJECTION_PATH)
+    except Exception as e:
+        print(f"Could not load projection '{PROJECTION_PATH}': {e}")
+        return None
+    print(f"Loaded {projection.method} projection {projection.input_dim} -> {projection.dim} dims")
+    return projection
@@ -0,0 +1,90 @@
+# quantization.py
+#
+# Low-precision copies of the serving matrix. With MEME_INDEX_PRECISION=int8 a folder
+# is coarse-scored from int8 codes (+ one float32 scale per row); float16 halves the
+# float32 size. Only the shortlisted candidates are re-ranked against higher-precision
+# rows, which come from one of two places:
+#
+#   - rows memory-mapped from the deployed snapshot's vectors.npy stay on disk and are
+#     paged in per candidate, so only the codes are resident (int8: ~4x smaller);
+#   - rows read from Firestore are kept as float16 in memory. Spilling them to a file
+#     would not help: /tmp on Cloud Functions is RAM (int8: ~1.3x smaller, float16: 2x).
+
+import os
+
+import numpy as np
+
+# --- Configuration ---
+# "float32" (no quantization), "float16" or "int8"
+INDEX_PRECISION = os.environ.get("MEME_INDEX_PRECISION", "float32")
+# Candidates re-scored against the re-rank rows after the low-precision pass.
+RERANK_CANDIDATES = int(os.environ.get("MEME_INDEX_RERANK_CANDIDATES", "200"))
+# File systems whose pages live in RAM: a memory map of such a file is not "off-heap".
+MEMORY_FILESYSTEMS = {"tmpfs", "ramfs"}
+
+# Rows converted back to float32 at a time while scoring, to bound temporary memory.
+SCORE_CHUNK_ROWS = 4096
+
+
+def quantize(matrix, precision):
+    """Returns (codes, scales); scales is None for float16."""
+    if precision == "float16":
+        return matrix.astype(np.float16), None
+    if precision == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.round(matrix / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown index precision '{precision}'")
+
+
+def coarse_scores(codes, scales, query_matrix, rows=None):
+    """Approximate scores of shape (num_queries, num_rows) from the low-precision codes."""
+    if rows is not None:
+        codes = codes[rows]
+        scales = scales[rows] if scales is not None else None
+
+    scores = np.empty((len(query_matrix), len(codes)), dtype=np.float32)
+    for start in range(0, len(codes), SCORE_CHUNK_ROWS):
+        chunk = codes[start:start + SCORE_CHUNK_ROWS].astype(np.float32)
+        scores[:, start:start + len(chunk)] = query_matrix @ chunk.T
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def rerank_matrix(matrix, codes, precision):
+    """Rows the shortlist is re-ranked against: the disk-backed memory map itself, else
+    a float16 copy (for float16 precision that copy is `codes`)."""
+    if is_disk_backed(matrix) or precision == "float32":
+        return matrix
+    if precision == "float16" and codes is not None:
+        return codes
+    return matrix.astype(np.float16)
+
+
+def is_disk_backed(array):
+    """True for a memory map of a file on a real disk (pages can be dropped under pressure)."""
+    filename = getattr(array, "filename", None)
+    if not isinstance(array, np.memmap) or filename is None:
+        return False
+    return _filesystem_type(filename) not in MEMORY_FILESYSTEMS
+
+
+def _filesystem_type(path):
+    """Type of the file system holding `path`, from the longest matching /proc/mounts entry."""
+    path = os.path.realpath(path)
+    best, best_type = "", None
+    try:
+        with open("/proc/mounts", "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point, fs_type = fields[1], fields[2]
+                if (path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) and len(mount_point) > len(best):
+                    best, best_type = mount_point, fs_type
+    except OSError:
+        # No /proc (macOS, Windows): assume an ordinary disk.
+        return None
+    return best_type
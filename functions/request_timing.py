@@ -0,0 +1,92 @@
+# request_timing.py
+#
+# Per-request phase timing for the search functions. A handler decorated with timed()
+# gets a RequestTimer for the duration of the call; span(name) anywhere below it (main.py,
+# meme_index.py) adds to that phase. Spans with the same name add up, e.g. one "score"
+# per folder. The result is returned as a Server-Timing header and, unless
+# REQUEST_TIMING_LOG=0, printed as one JSON log line that backend/latency_report.py
+# aggregates into p50/p95/p99 per phase.
+#
+# Outside a timed request span() only does a context-variable lookup, and inside one a
+# span costs two perf_counter calls, so this stays on in production. Work handed to a
+# thread pool with contextvars.copy_context().run keeps reporting to the same request;
+# such spans overlap the request thread's, so they can add up to more than "total".
+
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LOG_ENABLED = os.environ.get("REQUEST_TIMING_LOG", "1") != "0"
+
+_current = contextvars.ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    def __init__(self, function):
+        self.function = function
+        self.started = time.perf_counter()
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, ms):
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + ms
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self, total_ms):
+        """Server-Timing header value, phases in the order they first ran."""
+        entries = [f"{name};dur={ms:.1f}" for name, ms in self.spans.items()]
+        entries.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(entries)
+
+    def emit(self, total_ms, status):
+        print(json.dumps({
+            "event": "request_timing",
+            "function": self.function,
+            "status": status,
+            "total_ms": round(total_ms, 2),
+            "spans": {name: round(ms, 2) for name, ms in self.spans.items()},
+        }), flush=True)
+
+
+@contextmanager
+def span(name):
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, (time.perf_counter() - started) * 1000)
+
+
+def timed(function):
+    """Decorator for an https_fn handler: times the call and attaches Server-Timing.
+
+    Streaming bodies are produced after the handler returns, so their scoring is not
+    included; the header then only covers the work done before the first byte.
+    """
+    @functools.wraps(function)
+    def wrapper(req):
+        timer = RequestTimer(function.__name__)
+        token = _current.set(timer)
+        try:
+            response = function(req)
+        finally:
+            _current.reset(token)
+        total_ms = timer.total_ms()
+        response.headers["Server-Timing"] = timer.server_timing(total_ms)
+        # Lets browsers on other origins read the header through the Performance API.
+        response.headers["Timing-Allow-Origin"] = "*"
+        if LOG_ENABLED and req.method != "OPTIONS":
+            timer.emit(total_ms, response.status_code)
+        return response
+    return wrapper
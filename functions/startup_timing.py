@@ -0,0 +1,41 @@
+# startup_timing.py
+#
+# Cold-start instrumentation for main.py. Import and init steps are wrapped in span()
+# and always recorded (a perf_counter call each); with MEME_STARTUP_PROFILE=1 every
+# finished phase is also printed as one JSON log line. backend/bench_cold_start.py
+# reads those lines from fresh interpreters.
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+ENABLED = os.environ.get("MEME_STARTUP_PROFILE") == "1"
+
+# Taken when main.py imports this module first thing, i.e. as close to process start
+# as Python code can get.
+_started = time.perf_counter()
+_spans = []
+_lock = threading.Lock()
+
+
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _spans.append((name, (time.perf_counter() - started) * 1000))
+
+
+def report():
+    with _lock:
+        spans = {name: round(ms, 2) for name, ms in _spans}
+    return {"since_start_ms": round((time.perf_counter() - _started) * 1000, 2), "spans": spans}
+
+
+def emit(phase):
+    if ENABLED:
+        print(json.dumps({"event": "startup_profile", "phase": phase, **report()}), flush=True)
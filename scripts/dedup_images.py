@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:  # 只有計算雜湊需要 Pillow；其他腳本匯入 load_duplicates() 時不需要
+    Image = None
+
+# --- 配置 START ---
+# 支援的圖片副檔名 (爬蟲下載的是 .webp，assets 內是 .jpg/.png)
+IMAGE_EXTENSIONS = (".webp", ".jpg", ".jpeg", ".png")
+# 輸出的重複對照檔名稱，固定寫在圖片資料夾內 (assets/images/<folder>/duplicates.json)。
+# process_meme.py (IMAGE_FOLDER_PATH) 與 populate_firestore.py (--images-root/<folder>) 都從這裡讀取
+DUPLICATES_FILE = "duplicates.json"
+# 兩張圖的 64-bit 雜湊漢明距離 <= 此值即視為同一張圖
+DEFAULT_THRESHOLD = 6
+# --- 配置 END ---
+
+
+def image_id_from_filename(filename):
+    """與 process_meme.py 相同的 ID 規則：純數字檔名去掉前導零 (0042.webp -> "42")"""
+    stem = os.path.splitext(filename)[0]
+    return str(int(stem)) if re.fullmatch(r"\d+", stem) else stem
+
+
+def dhash(image, hash_size=8):
+    """差異雜湊：比較縮圖中左右相鄰像素的亮度"""
+    pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] *= 1 / np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def phash(image, hash_size=8):
+    """感知雜湊：32x32 灰階圖做 2D DCT，取左上 8x8 低頻係數與中位數比較"""
+    pixels = np.asarray(image.convert("L").resize((32, 32), Image.LANCZOS), dtype=np.float64)
+    low = (_DCT_32 @ pixels @ _DCT_32.T)[:hash_size, :hash_size].flatten()
+    # DC 係數只代表整體亮度，不參與中位數
+    bits = low > np.median(low[1:])
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+HASH_FUNCTIONS = {"dhash": dhash, "phash": phash}
+
+
+def hash_file(path, method):
+    """在子程序中執行；回傳 (路徑, 雜湊) 或 (路徑, None) 表示讀取失敗"""
+    try:
+        with Image.open(path) as image:
+            return path, HASH_FUNCTIONS[method](image)
+    except Exception as e:
+        print(f"無法計算雜湊 {path}: {e}")
+        return path, None
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """以漢明距離建立的 BK-tree，查詢半徑 r 內的節點不需逐一比對所有圖片"""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = (value, item, {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def find_nearest(self, value, radius):
+        """回傳距離 <= radius 中最近的 (距離, item)，沒有則回傳 None"""
+        best = None
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius and (best is None or distance < best[0]):
+                best = (distance, node[1])
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return best
+
+
+def sort_key(image_id):
+    return (0, int(image_id), "") if image_id.isdigit() else (1, 0, image_id)
+
+
+def find_duplicates(hashes, threshold):
+    """依 ID 由小到大處理，第一張出現的圖成為 canonical；回傳 {重複 ID: canonical ID}"""
+    tree = BKTree()
+    duplicates = {}
+    for image_id in sorted(hashes, key=sort_key):
+        match = tree.find_nearest(hashes[image_id], threshold)
+        if match is None:
+            tree.add(hashes[image_id], image_id)
+        else:
+            duplicates[image_id] = match[1]
+    return duplicates
+
+
+def load_duplicates(path):
+    """給 process_meme.py 與 populate_firestore.py 使用：讀取 {重複 ID: canonical ID}，檔案不存在時回傳空字典"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("duplicates", {})
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="以感知雜湊找出資料夾中幾乎相同的圖片，輸出 canonical ID 對照表")
+    parser.add_argument("folder", help="圖片資料夾路徑")
+    parser.add_argument("--hash", choices=sorted(HASH_FUNCTIONS), default="phash", help="雜湊演算法")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD, help="視為重複的最大漢明距離")
+    parser.add_argument("--output", default=None,
+                        help=f"輸出路徑 (預設: <folder>/{DUPLICATES_FILE}；其他路徑不會被上傳與描述腳本自動讀取)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="計算雜湊的程序數")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if Image is None:
+        raise SystemExit("計算感知雜湊需要 Pillow：pip install Pillow")
+    output = args.output or os.path.join(args.folder, DUPLICATES_FILE)
+
+    paths = sorted(
+        os.path.join(args.folder, name) for name in os.listdir(args.folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    print(f"找到 {len(paths)} 張圖片，使用 {args.hash} 與 {args.workers} 個程序計算雜湊...")
+
+    start_time = time.time()
+    hashes = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for path, value in executor.map(partial(hash_file, method=args.hash), paths, chunksize=16):
+            if value is not None:
+                hashes[image_id_from_filename(os.path.basename(path))] = value
+    print(f"雜湊計算完成，耗時 {time.time() - start_time:.1f} 秒。")
+
+    duplicates = find_duplicates(hashes, args.threshold)
+    canonical_count = len(hashes) - len(duplicates)
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "hash": args.hash,
+            "threshold": args.threshold,
+            "duplicates": duplicates,
+        }, f, ensure_ascii=False, indent=2)
+
+    print(f"共 {len(hashes)} 張圖片，{canonical_count} 張保留，{len(duplicates)} 張判定為重複。")
+    print(f"對照表已寫入 {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,18 @@
 import google.generativeai as genai
 import os
+import sys
 import json
 import time
 from pathlib import Path
 import re
+
+# 從圖片資料夾執行時也能找到同目錄的 dedup_images.py；去重是可選步驟，找不到就不略過任何圖片
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+try:
+    from dedup_images import DUPLICATES_FILE, load_duplicates
+except ImportError:
+    DUPLICATES_FILE = "duplicates.json"
+    load_duplicates = None
 # from PIL import Image # 如果遇到圖片格式問題，可能需要 PIL
 
 # --- 配置 START ---
@@ -13,6 +22,8 @@ IMAGE_FOLDER_PATH = r"."
 OUTPUT_JSON_FILE = "meme_data.json"
 # 錯誤日誌檔案名稱：預設與腳本同目錄
 ERROR_LOG_FILE = "error_log.txt"
+# dedup_images.py 產生的重複圖片對照表：列在其中的重複 ID 不會送去 Gemini 描述
+DUPLICATES_JSON_FILE = os.path.join(IMAGE_FOLDER_PATH, DUPLICATES_FILE)
 # 使用的 Gemini 模型名稱
 MODEL_NAME = "gemini-2.5-pro-preview-06-05" # 或其他你指定的 preview 版本，例如 "gemini-1.5-flash-preview-0514"
 # 儲存 Google Gemini API 金鑰的環境變數名稱
@@ -172,6 +183,16 @@ def save_data(data, json_file_path):
             except Exception as remove_e:
                 log_error(f"儲存失敗後移除暫存檔案 {temp_file_path} 失敗: {remove_e}")
 
+def load_duplicate_ids(json_file_path):
+    """dedup_images.load_duplicates()，沒有 dedup_images 或讀取失敗時不略過任何圖片"""
+    if load_duplicates is None:
+        return {}
+    try:
+        return load_duplicates(json_file_path)
+    except Exception as e:
+        log_error(f"讀取重複圖片對照表 {json_file_path} 失敗，將不略過任何圖片: {e}")
+        return {}
+
 def get_image_files_and_ids(folder_path):
     """獲取資料夾中所有 .webp 圖片的路徑和對應的 ID，並按 ID 排序"""
     image_paths_with_ids = []
@@ -370,6 +391,13 @@ def main():
         print(f"在指定的資料夾 ({IMAGE_FOLDER_PATH}) 中沒有找到符合 '數字.webp' 格式的圖片檔案。")
         return
 
+    # 略過與其他圖片幾乎相同的重複圖片 (只描述 canonical 那一張)
+    duplicate_ids = load_duplicate_ids(DUPLICATES_JSON_FILE)
+    if duplicate_ids:
+        before = len(image_files)
+        image_files = [img_info for img_info in image_files if str(img_info["id"]) not in duplicate_ids]
+        print(f"依照 {DUPLICATES_JSON_FILE} 略過 {before - len(image_files)} 張重複圖片。")
+
     total_found_images = len(image_files)
     print(f"\n總共找到 {total_found_images} 張圖片檔案。")
 